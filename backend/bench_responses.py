@@ -0,0 +1,102 @@
+"""Bytes on the wire and CPU per response for the GET /api/items payload.
+
+Compares the default FastAPI path (pydantic models -> jsonable_encoder ->
+json.dumps), orjson rendering and the msgspec summary view, each with and
+without gzip/brotli.
+
+    python bench_responses.py [number_of_items]
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bench")
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+import server
+
+
+def make_items(count):
+    now = datetime.now(timezone.utc)
+    items = []
+    for i in range(count):
+        images = [f"https://res.cloudinary.com/demo/image/upload/assets/ab/{uuid.uuid4().hex}/medium.webp" for _ in range(3)]
+        items.append({
+            "id": str(uuid.uuid4()),
+            "title": f"Cordless drill {i}",
+            "description": "Lightly used 18V cordless drill with two batteries, charger and a set of bits. " * 4,
+            "category": server.CATEGORIES[i % len(server.CATEGORIES)],
+            "value": 4500 + i,
+            "token_per_day": 5 + i % 20,
+            "owner_id": str(uuid.uuid4()),
+            "owner_location": "Pune",
+            "images": images,
+            "thumbnails": [url.replace("medium", "thumb") for url in images],
+            "availability_start": now,
+            "availability_end": now + timedelta(days=30),
+            "is_available": True,
+            "created_at": now,
+        })
+    return items
+
+
+def summary_document(item):
+    """What ITEM_SUMMARY_PROJECTION returns from MongoDB"""
+    return {
+        **{key: item[key] for key in ("id", "title", "category", "value", "token_per_day", "owner_id", "owner_location")},
+        "description": item["description"][:server.ITEM_SUMMARY_DESCRIPTION_LENGTH],
+        "images": item["images"][:1],
+        "thumbnails": item["thumbnails"][:1],
+    }
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = fn()
+    return body, (time.perf_counter() - start) / repeat
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = max(3, 20000 // count)
+    items = make_items(count)
+    summaries = [summary_document(item) for item in items]
+
+    encoders = {
+        "default (pydantic + json)": lambda: json.dumps(
+            jsonable_encoder([server.Item(**item) for item in items]), ensure_ascii=False, separators=(",", ":")
+        ).encode(),
+        "orjson (pydantic + orjson)": lambda: orjson.dumps(
+            jsonable_encoder([server.Item(**item) for item in items])
+        ),
+        "summary (msgspec)": lambda: server.item_summaries_encoder.encode(
+            [server.item_summary(item) for item in summaries]
+        ),
+    }
+    encodings = [None, "gzip"] + (["br"] if server.brotli else [])
+
+    print(f"{count} items, {repeat} runs each")
+    print(f"{'encoder':<28}{'encoding':<10}{'bytes':>10}{'encode ms':>12}{'total ms':>12}")
+    for name, encode in encoders.items():
+        body, encode_seconds = timed(encode, repeat)
+        for encoding in encodings:
+            if encoding:
+                payload, compress_seconds = timed(lambda: server.compress_body(body, encoding), repeat)
+            else:
+                payload, compress_seconds = body, 0.0
+            print(
+                f"{name:<28}{encoding or 'identity':<10}{len(payload):>10}"
+                f"{encode_seconds * 1000:>12.2f}{(encode_seconds + compress_seconds) * 1000:>12.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
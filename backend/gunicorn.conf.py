@@ -0,0 +1,37 @@
+# Production launcher: gunicorn -c gunicorn.conf.py server:app
+#
+# Every worker is a separate process with its own Motor client; all shared
+# state (balances, transactions, ...) lives in MongoDB, so workers can be
+# added or rolled without coordination.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Motor clients are not fork-safe: each worker connects after it is forked,
+# inside the app lifespan, instead of inheriting a preloaded client.
+preload_app = False
+
+# On SIGTERM workers stop accepting connections, finish in-flight requests
+# and then run the lifespan shutdown (which drains /api requests for up to
+# SHUTDOWN_DRAIN_SECONDS). Keep this above that value.
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+# Requests reach the workers through Render's load balancer, so the peer
+# address is always the proxy. Trust its X-Forwarded-For so uvicorn sets
+# request.client.host (the rate-limit key for anonymous routes) to the real
+# client. "*" suits a service reachable only through the proxy; list the
+# proxy addresses instead wherever they are known.
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "*")
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
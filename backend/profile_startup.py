@@ -0,0 +1,101 @@
+"""Cold start profile: import time per module and time to first healthy response.
+
+Imports server.py under `python -X importtime` and lists the slowest
+top-level imports, then starts uvicorn and polls GET /health until it
+answers. Exits with status 1 when that takes longer than the budget, so it
+can gate deploys. MongoDB does not need to be reachable: /health answers
+before the database is.
+
+    python profile_startup.py [--budget SECONDS] [--top N]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+
+
+def server_env():
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "startup_profile")
+    env.setdefault("CHANGE_STREAM_ENABLED", "false")
+    return env
+
+
+def import_times(top):
+    """(cumulative microseconds, module) for server.py's direct imports, slowest first"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=server_env(), capture_output=True, text=True, check=True
+    )
+    times, children = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is two spaces per level and a module is listed after its imports
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative), name.strip()))
+        elif depth == 0:
+            if name.strip() == "server":
+                times = [(int(cumulative), "server")] + children
+            children = []
+    times.sort(reverse=True)
+    return times[:top + 1]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_healthy(timeout):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=server_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.02)
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=3.0, help="seconds allowed until /health answers")
+    parser.add_argument("--top", type=int, default=15, help="number of imports to list")
+    args = parser.parse_args()
+
+    print(f"{'module':<40}{'cumulative ms':>15}")
+    for cumulative, name in import_times(args.top):
+        print(f"{name:<40}{cumulative / 1000:>15.1f}")
+
+    elapsed = time_to_healthy(timeout=max(args.budget * 5, 30))
+    if elapsed is None:
+        print("\n/health never answered")
+        sys.exit(1)
+    print(f"\ntime to first healthy response: {elapsed:.2f}s (budget {args.budget:.2f}s)")
+    if elapsed > args.budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
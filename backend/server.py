@@ -1,21 +1,46 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from starlette.datastructures import Headers, MutableHeaders
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference, ReturnDocument, DeleteOne, UpdateOne, ReplaceOne, WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import SecondaryPreferred
 import os
+import asyncio
+import time
+import math
+import sys
+import bisect
+import unicodedata
 import logging
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from collections import Counter, OrderedDict, defaultdict
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
 import bcrypt
+import numpy as np
 import jwt
 from enum import Enum
 import shutil
-import cloudinary
-import cloudinary.uploader
+import io
+import hashlib
+import base64
+import csv
+import json
+import gzip
+import msgspec
+import re
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
 import os
 from pathlib import Path
 
@@ -28,26 +53,660 @@ MONGO_URL = os.environ['MONGO_URL']
 DB_NAME = os.environ['DB_NAME']
 client=None
 db=None
+# Database handle for reads that tolerate replication lag (catalog browsing,
+# public reviews/complaints). Balance and transaction reads, and reads a
+# client expects to see its own writes in (e.g. an item it just edited),
+# stay on `db`.
+read_db=None
 
-# Create the main app without a prefix
-app = FastAPI()
+# MongoDB client tuning (all optional)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# Compressors unavailable locally (zstandard / python-snappy not installed)
+# are skipped by pymongo, which then falls back to the next one in the list.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+# Secondaries lagging further than this are not used for tolerant reads
+# (pymongo requires at least 90 seconds, 0 disables the check).
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "0"))
+
+def mongo_client_options() -> Dict[str, Any]:
+    """Build the AsyncIOMotorClient keyword arguments from the environment"""
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "compressors": MONGO_COMPRESSORS,
+        "retryWrites": True,
+        "retryReads": True,
+    }
+
+def tolerant_read_preference():
+    """Read preference for reads that can be served slightly stale"""
+    if MONGO_MAX_STALENESS_SECONDS > 0:
+        return SecondaryPreferred(max_staleness=MONGO_MAX_STALENESS_SECONDS)
+    return SecondaryPreferred()
+
+def database_handles(mongo_client):
+    """(db, read_db) for DB_NAME on `mongo_client`"""
+    # Primary reads by default: balances, transactions, auth
+    primary = mongo_client.get_database(DB_NAME, read_preference=ReadPreference.PRIMARY)
+    # Catalog browsing and public profile data may come from secondaries
+    tolerant = mongo_client.get_database(DB_NAME, read_preference=tolerant_read_preference())
+    return primary, tolerant
+
+# Readiness and graceful shutdown
+# How long a request arriving before Mongo is ready waits before getting a 503
+READY_WAIT_SECONDS = float(os.getenv("READY_WAIT_SECONDS", "10"))
+# How long shutdown waits for in-flight requests (e.g. token transfers) to finish
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "25"))
+MONGO_CONNECT_RETRY_MAX_SECONDS = float(os.getenv("MONGO_CONNECT_RETRY_MAX_SECONDS", "30"))
+
+ready_event = asyncio.Event()
+draining = False
+in_flight_requests = 0
+startup_task = None
+# Seconds from lifespan start to each startup milestone, for /metrics
+startup_timings: Dict[str, float] = {}
+
+# Cold start: after MongoDB is ready, WARMUP opens a few pooled connections
+# and builds the OpenAPI schema in the background, so the first real
+# requests do not pay for them
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+PERIODIC_JOB_STAGGER_SECONDS = float(os.getenv("PERIODIC_JOB_STAGGER_SECONDS", "1"))
+lifespan_started = time.monotonic()
+
+# Background jobs, started once MongoDB is ready and cancelled on shutdown
+periodic_jobs = []
+background_workers = []
+background_tasks: List[asyncio.Task] = []
+
+def background_worker(job):
+    """Register a long-running coroutine function started with the app"""
+    background_workers.append(job)
+    return job
+
+def periodic_job(interval_seconds: float):
+    """Register a coroutine function to run every `interval_seconds`"""
+    def register(job):
+        periodic_jobs.append((job, interval_seconds))
+        return job
+    return register
+
+async def run_periodically(job, interval_seconds: float, initial_delay: float = 0.0):
+    await ready_event.wait()
+    await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Background job {job.__name__} failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+# Metrics
+# Components register a callable returning a dict of counters; GET /metrics
+# reports all of them. Set METRICS_TOKEN to require a bearer token.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+metrics_sources = {}
+
+def register_metrics(name: str, collect):
+    metrics_sources[name] = collect
+
+register_metrics("startup", lambda: startup_timings)
+
+# Domain events
+# A MongoDB change stream is turned into normalized domain events so that
+# in-memory state (caches, models, counters) stays correct on every replica,
+# not just the one that handled the write.
+# Every subscriber keeps in-memory state that the process rebuilds when it
+# starts, so each process watches from its own start and only resumes (from
+# the last token it saw) after losing the connection. Replaying history from
+# an earlier process would apply those events twice.
+CHANGE_STREAM_ENABLED = os.getenv("CHANGE_STREAM_ENABLED", "true").lower() == "true"
+# Delete events carry the deleted document only with pre-images, which need
+# MongoDB 6.0+: "auto" checks the server version, "true"/"false" force it
+CHANGE_STREAM_PRE_IMAGES = os.getenv("CHANGE_STREAM_PRE_IMAGES", "auto").lower()
+
+class EventBus:
+    """In-process publish/subscribe for domain events"""
+
+    def __init__(self):
+        self.subscribers: Dict[str, List[Any]] = defaultdict(list)
+
+    def subscribe(self, event_type: str):
+        """Decorator registering an async handler for `event_type` ("*" for all)"""
+        def register(handler):
+            self.subscribers[event_type].append(handler)
+            return handler
+        return register
+
+    async def publish(self, event: Dict[str, Any]):
+        # A failing subscriber must not stop the others or the stream
+        for handler in self.subscribers[event["type"]] + self.subscribers["*"]:
+            try:
+                await handler(event)
+            except Exception as e:
+                logger.error(f"Event handler {handler.__name__} failed for {event['type']}: {e}")
+
+event_bus = EventBus()
+
+def normalize_change(change: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Map a raw change stream document to zero or more domain events.
+
+    Events look like {"type", "id", "operation", "fields", "document", "at"}
+    where `fields` lists the top-level fields an update touched and
+    `document` is the post-image (None for deletes).
+    """
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    document = change.get("fullDocument")
+    before = change.get("fullDocumentBeforeChange")
+    entity_id = (document or before or {}).get("id")
+    fields = [
+        field.split(".")[0]
+        for field in change.get("updateDescription", {}).get("updatedFields", {})
+    ]
+    base = {
+        "id": entity_id,
+        "operation": operation,
+        "fields": fields,
+        "document": document,
+        "at": change.get("wallTime") or datetime.now(timezone.utc)
+    }
+    events = []
+    if collection == "items":
+        events.append({"type": "item.changed", **base})
+    elif collection == "users":
+        events.append({"type": "user.changed", **base})
+        if operation == "update" and "tokens" in fields:
+            events.append({"type": "user.balance_changed", **base})
+    elif collection == "transactions":
+        if operation == "insert" or "status" in fields:
+            events.append({"type": "transaction.status_changed", **base})
+    return events
+
+# Deletes are only mapped to an entity id through the pre-image
+CHANGE_STREAM_PRE_IMAGE_COLLECTIONS = ["items", "users"]
+
+async def change_stream_pre_images() -> bool:
+    if CHANGE_STREAM_PRE_IMAGES != "auto":
+        return CHANGE_STREAM_PRE_IMAGES == "true"
+    info = await client.server_info()
+    return info["versionArray"][0] >= 6
+
+async def enable_change_stream_pre_images():
+    """Have MongoDB record pre-images for CHANGE_STREAM_PRE_IMAGE_COLLECTIONS"""
+    if not CHANGE_STREAM_ENABLED:
+        return
+    if not await change_stream_pre_images():
+        logger.warning("MongoDB before 6.0: delete events carry no entity id until the next rebuilds")
+        return
+    for collection in CHANGE_STREAM_PRE_IMAGE_COLLECTIONS:
+        try:
+            await db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure as e:
+            # e.g. the database user lacks the collMod privilege
+            logger.warning(f"Could not enable change stream pre-images on {collection}: {e}")
+
+@background_worker
+async def consume_change_stream():
+    """Publish domain events for changes to items, users and transactions"""
+    if not CHANGE_STREAM_ENABLED:
+        return
+    await ready_event.wait()
+    pipeline = [{"$match": {"ns.coll": {"$in": ["items", "users", "transactions"]}}}]
+    delay = 1.0
+    pre_images = None
+    resume_token = None
+    while True:
+        try:
+            if pre_images is None:
+                pre_images = await change_stream_pre_images()
+            async with db.watch(
+                pipeline,
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable" if pre_images else None,
+                resume_after=resume_token
+            ) as stream:
+                delay = 1.0
+                async for change in stream:
+                    for event in normalize_change(change):
+                        await event_bus.publish(event)
+                    resume_token = stream.resume_token
+        except OperationFailure as e:
+            if e.code == 40573:
+                logger.warning("Change streams need a replica set; domain events are disabled")
+                return
+            if e.code in (260, 280, 286):
+                # Resume point fell off the oplog: restart from now
+                logger.warning(f"Change stream history lost, restarting from now: {e}")
+                resume_token = None
+                continue
+            logger.error(f"Change stream failed: {e}")
+        except PyMongoError as e:
+            logger.error(f"Change stream failed: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+
+async def ensure_indexes():
+    """Create the indexes the API queries rely on (no-op when they exist)"""
+    await db.users.create_index("id", unique=True)
+    await db.users.create_index("email")
+    await db.users.create_index("username")
+    await db.items.create_index("id", unique=True)
+    await db.items.create_index("owner_id")
+    await db.items.create_index([("is_available", 1), ("category", 1)])
+    await db.transactions.create_index("id", unique=True)
+    await db.transactions.create_index([("borrower_id", 1), ("status", 1)])
+    await db.transactions.create_index([("owner_id", 1), ("status", 1)])
+    await db.transactions.create_index([("item_id", 1), ("status", 1)])
+    await db.transactions.create_index("created_at")
+    await db.item_neighbors.create_index("item_id", unique=True)
+    await db.item_neighbors.create_index("built_at")
+    await db.co_borrow_queue.create_index("created_at")
+    await db.user_activities.create_index([("user_id", 1), ("transaction_id", 1)], unique=True)
+    await db.user_activities.create_index([("user_id", 1), ("created_at", -1)])
+    await db.user_activities.create_index([("user_id", 1), ("status", 1), ("created_at", -1)])
+    await db.user_activities.create_index("transaction_id")
+    await db.user_activities.create_index("item.id")
+    await db.user_activities.create_index("counterpart.id")
+    await db.reviews.create_index("reviewed_user_id")
+    await db.complaints.create_index([("complained_user_id", 1), ("is_valid", 1)])
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+    await db.messages.create_index([("transaction_id", 1), ("timestamp", 1)])
+    await db.penalties.create_index([("user_id", 1), ("is_paid", 1)])
+    await db.penalties.create_index([("is_paid", 1), ("transaction_id", 1)])
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    await db.revocations.create_index("created_at")
+    await db.items.create_index([("owner_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.transactions.create_index([("borrower_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.transactions.create_index([("owner_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.notifications.create_index([("user_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.messages.create_index([("sender_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.messages.create_index([("receiver_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.sync_tombstones.create_index([("user_id", 1), ("deleted_at", 1)])
+    await db.sync_tombstones.create_index("expires_at", expireAfterSeconds=0)
+    await db.transactions.create_index("delivered_at", sparse=True)
+    await db.transactions.create_index([("status", 1), ("updated_at", 1)])
+    await db.penalties.create_index("created_at")
+    await db.reviews.create_index("created_at")
+    await db.complaints.create_index("created_at")
+    await db.item_trends.create_index("item_id", unique=True)
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    await db.reviews.create_index([("transaction_id", 1), ("reviewer_id", 1)])
+    await db.reviews.create_index("scored_at")
+    await db.complaints.create_index([("transaction_id", 1), ("complainant_id", 1)])
+    await db.complaints.create_index("scored_at")
+    await db.users.create_index([("stars", -1), ("success_rate", -1)])
+    await db.users.create_index([("location", 1), ("stars", -1), ("success_rate", -1)])
+    await create_archive_collections()
+    await db.transactions_archive.create_index("id", unique=True)
+    await db.transactions_archive.create_index("borrower_id")
+    await db.transactions_archive.create_index("owner_id")
+    await db.messages_archive.create_index([("transaction_id", 1), ("timestamp", 1)])
+    await db.user_activities_archive.create_index([("user_id", 1), ("created_at", -1)])
+    await db.notifications_archive.create_index([("user_id", 1), ("created_at", -1)])
+    await db.penalties_archive.create_index([("user_id", 1), ("created_at", 1)])
+    await db.revocations.create_index("expires_at", expireAfterSeconds=0)
+    await db.image_assets.create_index("hash", unique=True)
+    await db.image_assets.create_index("medium")
+    await db.image_assets.create_index("thumb")
+    await db.image_assets.create_index("original")
+    await db.image_assets.create_index("public_ids")
+    await db.image_deletions.create_index("id", unique=True)
+    await db.image_deletions.create_index([("attempts", 1), ("next_attempt_at", 1)])
+    await db.items.create_index("images")
+    await db.items.create_index([("is_available", 1), ("owner_location", 1)])
+    await enable_change_stream_pre_images()
 
-@app.on_event("startup")
 async def startup_db_client():
-    global client, db
-    print("Connecting to MongoDB...")
+    """Connect to MongoDB and create indexes, retrying until it succeeds"""
+    global client, db, read_db
     if not MONGO_URL or not DB_NAME:
         print("❌ MONGO_URL or DB_NAME not set in environment variables")
         return
-    try:
-        client = AsyncIOMotorClient(MONGO_URL, serverSelectionTimeoutMS=5000)
-        db = client[DB_NAME]
-        # Actually test the connection
-        await client.admin.command('ping')
-        print(f"✅ Connected to MongoDB successfully: database-->{DB_NAME}")
-    except Exception as e:
-        print(f"❌ Failed to connect to MongoDB: {e}")
-        db = None
+    delay = 1.0
+    while True:
+        print("Connecting to MongoDB...")
+        try:
+            client = AsyncIOMotorClient(MONGO_URL, **mongo_client_options())
+            db, read_db = database_handles(client)
+            # Actually test the connection
+            await client.admin.command('ping')
+            await ensure_indexes()
+            print(f"✅ Connected to MongoDB successfully: database-->{DB_NAME}")
+            await revocation_set.refresh()
+            ready_event.set()
+            startup_timings["ready"] = round(time.monotonic() - lifespan_started, 3)
+            return
+        except Exception as e:
+            print(f"❌ Failed to connect to MongoDB: {e} (retrying in {delay:.0f}s)")
+            if client:
+                client.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MONGO_CONNECT_RETRY_MAX_SECONDS)
+
+@background_worker
+async def warm_up():
+    if not WARMUP:
+        return
+    await ready_event.wait()
+    # Concurrent pings make each pool open that many connections now
+    await asyncio.gather(*[
+        database.command("ping", read_preference=database.read_preference)
+        for database in (db, read_db)
+        for _ in range(WARMUP_CONNECTIONS)
+    ], return_exceptions=True)
+    # Also generates every model's JSON schema, cached on the app
+    await asyncio.to_thread(app.openapi)
+    startup_timings["warm"] = round(time.monotonic() - lifespan_started, 3)
+
+async def drain_in_flight_requests():
+    """Stop admitting API requests and wait for the running ones to finish"""
+    global draining
+    draining = True
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    while in_flight_requests > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if in_flight_requests > 0:
+        print(f"⚠️ Shutting down with {in_flight_requests} requests still in flight")
+
+def shutdown_db_client():
+    if client:
+        client.close()
+        print("MongoDB connection closed")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global startup_task, lifespan_started
+    lifespan_started = time.monotonic()
+    # Connect in the background so /health answers immediately; API traffic
+    # is held by ReadinessMiddleware until the database is usable.
+    startup_task = asyncio.create_task(startup_db_client())
+    # Staggered so the first runs do not all land on the first requests
+    for i, (job, interval_seconds) in enumerate(periodic_jobs):
+        background_tasks.append(asyncio.create_task(
+            run_periodically(job, interval_seconds, i * PERIODIC_JOB_STAGGER_SECONDS)
+        ))
+    for job in background_workers:
+        background_tasks.append(asyncio.create_task(job()))
+    yield
+    await drain_in_flight_requests()
+    startup_task.cancel()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    if image_pool:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+    shutdown_db_client()
+
+class ReadinessMiddleware:
+    """Hold /api traffic until MongoDB is ready and track in-flight requests.
+
+    Implemented as a plain ASGI middleware so a client disconnect never
+    cancels a handler halfway through a multi-document token transfer.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global in_flight_requests
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            await self.app(scope, receive, send)
+            return
+        if draining:
+            response = JSONResponse(
+                {"detail": "Server is shutting down"},
+                status_code=503,
+                headers={"Retry-After": "1", "Connection": "close"}
+            )
+            await response(scope, receive, send)
+            return
+        if not ready_event.is_set():
+            try:
+                await asyncio.wait_for(ready_event.wait(), READY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                response = JSONResponse(
+                    {"detail": "Service is starting up"},
+                    status_code=503,
+                    headers={"Retry-After": "5"}
+                )
+                await response(scope, receive, send)
+                return
+        in_flight_requests += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            in_flight_requests -= 1
+
+# Response encoding
+# "orjson" renders responses with orjson, "json" with the standard library
+RESPONSE_ENCODER = os.getenv("RESPONSE_ENCODER", "orjson")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson", "application/javascript")
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header, honouring q=0"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    if brotli and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """Compress buffered responses with brotli or gzip.
+
+    Bodies smaller than COMPRESSION_MIN_SIZE, non-text content types and
+    streamed responses are passed through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        streaming = False
+
+        async def send_compressed(message):
+            nonlocal start_message, streaming
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or streaming:
+                await send(message)
+                return
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if message.get("more_body", False):
+                streaming = True
+            elif (
+                len(body) >= COMPRESSION_MIN_SIZE
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            ):
+                body = compress_body(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+# Idempotency keys
+# Retried POSTs carrying the same Idempotency-Key header get the original
+# response replayed instead of running the handler again (duplicate borrow
+# requests, messages, reviews or complaints). Keys are scoped to the caller
+# and kept for IDEMPOTENCY_TTL_HOURS in a TTL-indexed collection.
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# An attempt that died mid-request stops blocking retries after this long
+IDEMPOTENCY_LOCK_SECONDS = 60
+IDEMPOTENT_PATHS = re.compile(
+    r"^/api/(transactions/(request|[^/]+/(approve|reject|confirm-delivery|confirm-return))"
+    r"|messages|reviews|complaints|process-pending-penalties)$"
+)
+
+def request_fingerprint(scope, body: bytes) -> str:
+    """Hash of everything that defines a request: a key reused for a request
+    differing in any of it is rejected instead of replayed"""
+    request_line = f"{scope['method']} {scope['path']}?".encode() + scope.get("query_string", b"")
+    return hashlib.sha256(request_line + b" " + body).hexdigest()
+
+class IdempotencyMiddleware:
+    """Record and replay responses of idempotent-keyed POST requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not IDEMPOTENT_PATHS.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        key = headers.get("idempotency-key")
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        try:
+            user_id = decode_token(token)["sub"] if key and scheme.lower() == "bearer" else None
+        except HTTPException:
+            user_id = None
+        if not user_id:
+            # Anonymous or invalid tokens are rejected by the handler anyway
+            await self.app(scope, receive, send)
+            return
+        if len(key) > 255:
+            await JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)(scope, receive, send)
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        record_id = f"{user_id}:{key}"
+        fingerprint = request_fingerprint(scope, body)
+
+        record = await self.claim(record_id, fingerprint)
+        if record is not None:
+            await self.reject_or_replay(record, fingerprint, scope, receive, send)
+            return
+
+        body_sent = False
+
+        async def replay_body():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        response = {"headers": [], "body": b""}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode("latin-1"), value.decode("latin-1")] for name, value in message["headers"]]
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, capture)
+        except BaseException:
+            await db.idempotency_keys.delete_one({"_id": record_id})
+            raise
+        # Server errors and rate limiting are not final: let the retry run
+        if response.get("status", 500) >= 500 or response["status"] == 429:
+            await db.idempotency_keys.delete_one({"_id": record_id})
+            return
+        await db.idempotency_keys.update_one(
+            {"_id": record_id},
+            {"$set": {"state": "completed", "response": response}, "$unset": {"locked_until": ""}}
+        )
+
+    async def claim(self, record_id: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Reserve the key for this attempt; returns the existing record
+        instead when another attempt already holds or finished it"""
+        now = datetime.now(timezone.utc)
+        lock = {
+            "fingerprint": fingerprint,
+            "state": "in_progress",
+            "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        }
+        try:
+            await db.idempotency_keys.insert_one({"_id": record_id, **lock})
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over from an attempt that never finished
+        stale = await db.idempotency_keys.find_one_and_update(
+            {"_id": record_id, "state": "in_progress", "fingerprint": fingerprint, "locked_until": {"$lt": now}},
+            {"$set": lock}
+        )
+        if stale:
+            return None
+        return await db.idempotency_keys.find_one({"_id": record_id}) or {"state": "in_progress", "fingerprint": fingerprint}
+
+    async def reject_or_replay(self, record: Dict[str, Any], fingerprint: str, scope, receive, send):
+        if record["fingerprint"] != fingerprint:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key was already used for a different request"},
+                status_code=422
+            )
+        elif record["state"] != "completed":
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is still in progress"},
+                status_code=409,
+                headers={"Retry-After": "1"}
+            )
+        else:
+            stored = record["response"]
+            response = Response(content=stored["body"], status_code=stored["status"])
+            response.raw_headers = [
+                (name.encode("latin-1"), value.encode("latin-1")) for name, value in stored["headers"]
+            ] + [(b"idempotent-replayed", b"true")]
+        await response(scope, receive, send)
+
+# Create the main app without a prefix
+app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if RESPONSE_ENCODER == "orjson" else JSONResponse
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -55,17 +714,34 @@ api_router = APIRouter(prefix="/api")
 # JWT settings
 SECRET_KEY = "your-secret-key-here"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Access tokens carry the claims needed to authenticate without a database
+# read; revocations (bans, deleted accounts) reach them through the in-memory
+# RevocationSet within REVOCATION_REFRESH_SECONDS.
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
+REVOCATION_FULL_RELOAD_SECONDS = 3600
 
 # Security
 security = HTTPBearer()
 
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=os.getenv("CLOUD_NAME"),
-    api_key=os.getenv("CLOUD_API_KEY"),
-    api_secret=os.getenv("CLOUD_API_SECRET")
-)
+# Cloudinary, imported and configured on first use: most requests (and
+# every cold start) never touch it
+cloudinary_sdk = None
+
+def get_cloudinary():
+    global cloudinary_sdk
+    if cloudinary_sdk is None:
+        import cloudinary
+        import cloudinary.api
+        import cloudinary.uploader
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUD_NAME"),
+            api_key=os.getenv("CLOUD_API_KEY"),
+            api_secret=os.getenv("CLOUD_API_SECRET")
+        )
+        cloudinary_sdk = cloudinary
+    return cloudinary_sdk
 
 # Categories
 CATEGORIES = [
@@ -107,6 +783,9 @@ class UserLogin(BaseModel):
     email_or_username: str
     password: str
 
+class TokenRefresh(BaseModel):
+    refresh_token: str
+
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     email: str
@@ -118,9 +797,20 @@ class User(BaseModel):
     success_rate: float = 0.0
     complaints_count: int = 0
     is_banned: bool = False
+    token_version: int = 0  # Bumped to revoke every token issued so far
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     profile_image: Optional[str] = None
 
+class TokenUser(BaseModel):
+    """Caller identity taken from access token claims (no database read).
+
+    `username` is as of when the token was issued: read it from the user
+    document wherever it is shown to other users.
+    """
+    id: str
+    username: str
+    token_version: int = 0
+
 class UserProfile(BaseModel):
     id: str
     username: str
@@ -141,11 +831,50 @@ class Item(BaseModel):
     value: int  # Max 100000
     token_per_day: int
     owner_id: str
+    owner_location: Optional[str] = None  # Denormalized from the owner for catalog facets
     images: List[str] = []
+    thumbnails: List[str] = []  # Small renditions of `images`, same order
     availability_start: datetime
     availability_end: datetime
     is_available: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ItemSummary(msgspec.Struct):
+    """Catalog row for list views: short description and one thumbnail"""
+    id: str
+    title: str
+    description: str
+    category: str
+    value: int
+    token_per_day: int
+    owner_id: str
+    owner_location: Optional[str] = None
+    image: Optional[str] = None
+
+ITEM_SUMMARY_DESCRIPTION_LENGTH = 120
+ITEM_SUMMARY_PROJECTION = {
+    "_id": 0, "id": 1, "title": 1, "category": 1, "value": 1, "token_per_day": 1,
+    "owner_id": 1, "owner_location": 1,
+    "description": {"$substrCP": ["$description", 0, ITEM_SUMMARY_DESCRIPTION_LENGTH]},
+    "images": {"$slice": ["$images", 1]},
+    "thumbnails": {"$slice": ["$thumbnails", 1]},
+}
+item_summaries_encoder = msgspec.json.Encoder()
+
+def item_summary(item: Dict[str, Any]) -> ItemSummary:
+    images = item.get("thumbnails") or item.get("images") or []
+    return ItemSummary(
+        id=item["id"],
+        title=item["title"],
+        description=item["description"],
+        category=item["category"],
+        value=item["value"],
+        token_per_day=item["token_per_day"],
+        owner_id=item["owner_id"],
+        owner_location=item.get("owner_location"),
+        image=images[0] if images else None
+    )
 
 class ItemCreate(BaseModel):
     title: str
@@ -170,7 +899,10 @@ class Transaction(BaseModel):
     borrower_confirmed_delivery: bool = False
     owner_confirmed_return: bool = False
     borrower_confirmed_return: bool = False
+    delivered_at: Optional[datetime] = None
+    tokens_paid: int = 0  # At delivery; less than total_tokens when a penalty covers the rest
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class TransactionRequest(BaseModel):
     item_id: str
@@ -185,6 +917,9 @@ class Review(BaseModel):
     reviewed_user_id: str
     stars: int
     comment: Optional[str] = None
+    is_flagged: bool = False  # Excluded from stars and listings
+    flags: List[str] = []
+    scored_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ReviewCreate(BaseModel):
@@ -202,6 +937,8 @@ class Complaint(BaseModel):
     description: str
     proof_images: List[str] = []
     is_valid: bool = False
+    flags: List[str] = []  # Reasons score_reputation rejected it
+    scored_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ComplaintCreate(BaseModel):
@@ -219,6 +956,7 @@ class Notification(BaseModel):
     related_id: Optional[str] = None
     is_read: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Message(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -227,6 +965,7 @@ class Message(BaseModel):
     receiver_id: str
     message: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class MessageCreate(BaseModel):
     transaction_id: str
@@ -259,22 +998,123 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def create_refresh_token(data: dict):
+    to_encode = {"sub": data["sub"], "ver": data["ver"], "jti": str(uuid.uuid4())}
+    expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode.update({"exp": expire, "type": "refresh"})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def create_token_pair(user: Dict[str, Any]) -> Dict[str, str]:
+    """Access and refresh tokens for a user document"""
+    claims = {
+        "sub": user["id"],
+        "username": user["username"],
+        "banned": user.get("is_banned", False),
+        "ver": user.get("token_version", 0)
+    }
+    return {
+        "access_token": create_access_token(claims),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer"
+    }
+
+class RevocationSet:
+    """Minimum valid token version per revoked user, mirrored from the
+    `revocations` collection. Only users revoked within the refresh token
+    lifetime are kept, so the set stays small."""
+
+    def __init__(self):
+        self.min_versions: Dict[str, int] = {}
+        self.synced_at: Optional[datetime] = None
+        self.loaded_at: Optional[datetime] = None
+
+    def is_revoked(self, user_id: str, token_version: int) -> bool:
+        return token_version < self.min_versions.get(user_id, 0)
+
+    def revoke(self, user_id: str, min_version: int):
+        self.min_versions[user_id] = max(min_version, self.min_versions.get(user_id, 0))
+
+    async def refresh(self):
+        now = datetime.now(timezone.utc)
+        full_reload = self.loaded_at is None or (now - self.loaded_at).total_seconds() > REVOCATION_FULL_RELOAD_SECONDS
+        query = {}
+        if not full_reload:
+            # Overlap the previous sync to tolerate clock skew between replicas
+            query["created_at"] = {"$gte": self.synced_at - timedelta(seconds=REVOCATION_REFRESH_SECONDS)}
+        min_versions = {} if full_reload else self.min_versions
+        async for revocation in db.revocations.find(query, {"user_id": 1, "min_version": 1}):
+            min_versions[revocation["user_id"]] = max(revocation["min_version"], min_versions.get(revocation["user_id"], 0))
+        self.min_versions = min_versions
+        self.synced_at = now
+        if full_reload:
+            self.loaded_at = now
+
+revocation_set = RevocationSet()
+
+@periodic_job(REVOCATION_REFRESH_SECONDS)
+async def refresh_revocations():
+    await revocation_set.refresh()
+
+@event_bus.subscribe("user.changed")
+async def revocations_on_user_changed(event: Dict[str, Any]):
+    if "token_version" in event["fields"] and event["document"]:
+        revocation_set.revoke(event["id"], event["document"]["token_version"])
+
+async def revoke_user_tokens(user_id: str, reason: str):
+    """Invalidate every access and refresh token issued to a user so far"""
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"token_version": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        return
+    now = datetime.now(timezone.utc)
+    await db.revocations.insert_one({
+        "user_id": user_id,
+        "min_version": user["token_version"],
+        "reason": reason,
+        "created_at": now,
+        # Older tokens have all expired by then
+        "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    })
+    revocation_set.revoke(user_id, user["token_version"])
+
+def decode_token(token: str, token_type: str = "access") -> Dict[str, Any]:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    # Tokens issued before refresh tokens existed have no type
+    if payload.get("sub") is None or payload.get("type", "access") != token_type:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if revocation_set.is_revoked(payload["sub"], payload.get("ver", 0)):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Full user document; use for routes that need balance or profile data"""
+    payload = decode_token(credentials.credentials)
+    user = await db.users.find_one({"id": payload["sub"]})
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if user.get("is_banned", False):
+        raise HTTPException(status_code=403, detail="Account is banned")
+    return User(**user)
+
+async def get_token_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenUser:
+    """Caller identity from the access token claims alone, without a database read"""
+    payload = decode_token(credentials.credentials)
+    if "username" not in payload:
+        user = await get_current_user(credentials)
+        return TokenUser(id=user.id, username=user.username, token_version=user.token_version)
+    if payload.get("banned"):
+        raise HTTPException(status_code=403, detail="Account is banned")
+    return TokenUser(id=payload["sub"], username=payload["username"], token_version=payload.get("ver", 0))
 
 def calculate_token_value(base_value: int, category: str) -> int:
     """Calculate suggested token value based on item value and category"""
@@ -302,27 +1142,607 @@ async def create_notification(user_id: str, title: str, message: str, type: str,
     )
     await db.notifications.insert_one(notification.dict())
 
-async def update_user_stats(user_id: str):
-    """Update user's stars and success rate"""
-    # Get all reviews for this user
-    reviews = await db.reviews.find({"reviewed_user_id": user_id}).to_list(None)
-    if reviews:
-        avg_stars = sum(review["stars"] for review in reviews) / len(reviews)
-        await db.users.update_one({"id": user_id}, {"$set": {"stars": avg_stars}})
-    
-    # Calculate success rate
-    total_transactions = await db.transactions.count_documents({"$or": [{"borrower_id": user_id}, {"owner_id": user_id}]})
-    completed_transactions = await db.transactions.count_documents({
-        "$or": [{"borrower_id": user_id}, {"owner_id": user_id}],
-        "status": TransactionStatus.COMPLETED
-    })
-    
-    if total_transactions > 0:
-        success_rate = (completed_transactions / total_transactions) * 100
-        await db.users.update_one({"id": user_id}, {"$set": {"success_rate": success_rate}})
+# Reputation scoring
+# Reviews and complaints are not applied when filed. A batch job scores the
+# pending ones against per-user activity features over the last
+# FRAUD_WINDOW_DAYS (complaint velocity, retaliatory complaint pairs, review
+# bursts), flags suspicious ones, and then recomputes stars, success rates,
+# complaint counts and bans for every affected user in one bulk write.
+REPUTATION_SCORING_SECONDS = float(os.getenv("REPUTATION_SCORING_SECONDS", "60"))
+FRAUD_WINDOW_DAYS = 30
+FRAUD_MAX_COMPLAINTS_PER_DAY = int(os.getenv("FRAUD_MAX_COMPLAINTS_PER_DAY", "3"))
+FRAUD_MAX_REVIEWS_PER_HOUR = int(os.getenv("FRAUD_MAX_REVIEWS_PER_HOUR", "5"))
+FRAUD_MAX_REVIEWS_RECEIVED_PER_DAY = int(os.getenv("FRAUD_MAX_REVIEWS_RECEIVED_PER_DAY", "15"))
+# Each valid complaint in this window halves the user's review average
+COMPLAINT_STAR_WINDOW_DAYS = 90
+BAN_COMPLAINT_COUNT = 20
+
+def score_activity(
+    complaints: List[Dict[str, Any]],
+    reviews: List[Dict[str, Any]],
+    now: datetime
+) -> Tuple[List[List[str]], List[List[str]]]:
+    """Flags for each complaint and review (same order), from activity features
+    computed over all of them at once"""
+    users: Dict[str, int] = {}
+    def indices(ids) -> np.ndarray:
+        return np.array([users.setdefault(user_id, len(users)) for user_id in ids], dtype=np.int64)
+    def ages(docs) -> np.ndarray:
+        return np.array([(now - doc["created_at"].replace(tzinfo=timezone.utc)).total_seconds() for doc in docs])
+
+    complainants = indices(complaint["complainant_id"] for complaint in complaints)
+    complained = indices(complaint["complained_user_id"] for complaint in complaints)
+    complaint_ages = ages(complaints)
+    reviewers = indices(review["reviewer_id"] for review in reviews)
+    reviewed = indices(review["reviewed_user_id"] for review in reviews)
+    review_ages = ages(reviews)
+    stars = np.array([review["stars"] for review in reviews])
+    n = max(len(users), 1)
+
+    # Complaints filed per user in the last day
+    velocity = np.bincount(complainants[complaint_ages < 86400], minlength=n)
+    # A complaint against someone who had already complained about the
+    # complainant looks like retaliation
+    pair_keys = complainants * n + complained
+    retaliation = np.zeros(len(complaints), dtype=bool)
+    if len(complaints):
+        pairs, pair_index = np.unique(pair_keys, return_inverse=True)
+        first_filed = np.full(len(pairs), np.inf)
+        np.minimum.at(first_filed, pair_index, -complaint_ages)
+        reverse = complained * n + complainants
+        position = np.minimum(np.searchsorted(pairs, reverse), len(pairs) - 1)
+        retaliation = (pairs[position] == reverse) & (first_filed[position] < -complaint_ages)
+
+    # Reviews written per user in the last hour and received in the last day
+    written = np.bincount(reviewers[review_ages < 3600], minlength=n)
+    received = np.bincount(reviewed[review_ages < 86400], minlength=n)
+    # Low ratings for someone who complained about the reviewer
+    retaliatory_review = (stars <= 2) & np.isin(reviewed * n + reviewers, pair_keys)
+
+    complaint_flags = [
+        [flag for flag, hit in (
+            ("complaint_velocity", velocity[complainants[i]] > FRAUD_MAX_COMPLAINTS_PER_DAY),
+            ("retaliation", retaliation[i]),
+        ) if hit]
+        for i in range(len(complaints))
+    ]
+    review_flags = [
+        [flag for flag, hit in (
+            ("review_burst", written[reviewers[i]] > FRAUD_MAX_REVIEWS_PER_HOUR),
+            ("received_burst", received[reviewed[i]] > FRAUD_MAX_REVIEWS_RECEIVED_PER_DAY),
+            ("retaliation", retaliatory_review[i]),
+        ) if hit]
+        for i in range(len(reviews))
+    ]
+    return complaint_flags, review_flags
+
+def is_pending_score(doc: Dict[str, Any]) -> bool:
+    # Documents filed before scoring existed have no scored_at at all
+    return "scored_at" in doc and doc["scored_at"] is None
+
+async def apply_reputation(user_ids: List[str], new_valid_complaints: Counter, now: datetime):
+    """Recompute stars and success rate of `user_ids`, count their newly
+    valid complaints and ban those reaching BAN_COMPLAINT_COUNT"""
+    participants = {"$or": [{"borrower_id": {"$in": user_ids}}, {"owner_id": {"$in": user_ids}}]}
+    averages, recent_complaints, outcomes, users = await asyncio.gather(
+        db.reviews.aggregate([
+            {"$match": {"reviewed_user_id": {"$in": user_ids}, "is_flagged": {"$ne": True}}},
+            {"$group": {"_id": "$reviewed_user_id", "stars": {"$avg": "$stars"}}}
+        ]).to_list(None),
+        db.complaints.aggregate([
+            {"$match": {
+                "complained_user_id": {"$in": user_ids},
+                "is_valid": True,
+                "created_at": {"$gte": now - timedelta(days=COMPLAINT_STAR_WINDOW_DAYS)}
+            }},
+            {"$group": {"_id": "$complained_user_id", "count": {"$sum": 1}}}
+        ]).to_list(None),
+        # Archived transactions still count towards the success rate
+        db.transactions.aggregate([
+            {"$match": participants},
+            {"$unionWith": {"coll": "transactions_archive", "pipeline": [{"$match": participants}]}},
+            {"$project": {"status": 1, "user_id": ["$borrower_id", "$owner_id"]}},
+            {"$unwind": "$user_id"},
+            {"$match": {"user_id": {"$in": user_ids}}},
+            {"$group": {
+                "_id": "$user_id",
+                "total": {"$sum": 1},
+                "completed": {"$sum": {"$cond": [{"$eq": ["$status", TransactionStatus.COMPLETED]}, 1, 0]}}
+            }}
+        ]).to_list(None),
+        db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "complaints_count": 1, "is_banned": 1}).to_list(None)
+    )
+    average = {row["_id"]: row["stars"] for row in averages}
+    complaint_counts = {row["_id"]: row["count"] for row in recent_complaints}
+    rates = {row["_id"]: row for row in outcomes}
+
+    ids = [user["id"] for user in users]
+    stars = np.array([average.get(user_id, 0.0) for user_id in ids]) * np.exp2(
+        -np.array([complaint_counts.get(user_id, 0) for user_id in ids], dtype=np.float64)
+    )
+    operations, newly_banned = [], []
+    for user, user_stars in zip(users, stars):
+        update = {"$set": {"stars": float(user_stars)}}
+        rate = rates.get(user["id"])
+        if rate and rate["total"]:
+            update["$set"]["success_rate"] = rate["completed"] / rate["total"] * 100
+        added = new_valid_complaints.get(user["id"], 0)
+        if added:
+            update["$inc"] = {"complaints_count": added}
+            if user.get("complaints_count", 0) + added >= BAN_COMPLAINT_COUNT and not user.get("is_banned", False):
+                update["$set"]["is_banned"] = True
+                newly_banned.append(user["id"])
+        operations.append(UpdateOne({"id": user["id"]}, update))
+    if operations:
+        await db.users.bulk_write(operations, ordered=False)
+    # Banned users lose their sessions within seconds, not at token expiry
+    for user_id in newly_banned:
+        await revoke_user_tokens(user_id, "banned")
+
+@periodic_job(REPUTATION_SCORING_SECONDS)
+async def score_reputation():
+    """Score pending reviews and complaints and apply reputation changes"""
+    now = datetime.now(timezone.utc)
+    state = await db.reputation_state.find_one({"_id": "scoring"})
+    since = state["scored_until"] if state else now
+    recent = {"$or": [
+        {"created_at": {"$gte": now - timedelta(days=FRAUD_WINDOW_DAYS)}},
+        {"scored_at": {"$type": "null"}}
+    ]}
+    star_window = timedelta(days=COMPLAINT_STAR_WINDOW_DAYS)
+    complaints, reviews, completed, expired = await asyncio.gather(
+        db.complaints.find(recent, {
+            "_id": 1, "complainant_id": 1, "complained_user_id": 1, "created_at": 1, "scored_at": 1
+        }).to_list(None),
+        db.reviews.find(recent, {
+            "_id": 1, "reviewer_id": 1, "reviewed_user_id": 1, "stars": 1, "created_at": 1, "scored_at": 1
+        }).to_list(None),
+        db.transactions.find(
+            {"status": TransactionStatus.COMPLETED, "updated_at": {"$gte": since}},
+            {"_id": 0, "borrower_id": 1, "owner_id": 1}
+        ).to_list(None),
+        # Valid complaints that left the star window since the previous run
+        db.complaints.distinct("complained_user_id", {
+            "is_valid": True,
+            "created_at": {"$gte": since - star_window, "$lt": now - star_window}
+        })
+    )
+    complaint_flags, review_flags = score_activity(complaints, reviews, now)
+
+    affected = {user_id for transaction in completed for user_id in (transaction["borrower_id"], transaction["owner_id"])}
+    affected.update(expired)
+    new_valid_complaints = Counter()
+    complaint_updates, review_updates, flagged = [], [], 0
+    for complaint, flags in zip(complaints, complaint_flags):
+        if not is_pending_score(complaint):
+            continue
+        complaint_updates.append(UpdateOne(
+            {"_id": complaint["_id"]},
+            {"$set": {"is_valid": not flags, "flags": flags, "scored_at": now}}
+        ))
+        if flags:
+            flagged += 1
+        else:
+            new_valid_complaints[complaint["complained_user_id"]] += 1
+            affected.add(complaint["complained_user_id"])
+    for review, flags in zip(reviews, review_flags):
+        if not is_pending_score(review):
+            continue
+        review_updates.append(UpdateOne(
+            {"_id": review["_id"]},
+            {"$set": {"is_flagged": bool(flags), "flags": flags, "scored_at": now}}
+        ))
+        flagged += bool(flags)
+        affected.add(review["reviewed_user_id"])
+
+    if complaint_updates:
+        await db.complaints.bulk_write(complaint_updates, ordered=False)
+    if review_updates:
+        await db.reviews.bulk_write(review_updates, ordered=False)
+    if affected:
+        await apply_reputation(sorted(affected), new_valid_complaints, now)
+    await db.reputation_state.update_one({"_id": "scoring"}, {"$set": {"scored_until": now}}, upsert=True)
+    if flagged:
+        logger.info(
+            f"Reputation scoring: {len(complaint_updates)} complaints and {len(review_updates)} reviews, {flagged} flagged"
+        )
+
+# Archival
+# Transactions finished more than ARCHIVE_AFTER_DAYS ago (with their messages
+# and activity entries, unless a penalty on them is still unpaid), and read
+# notifications and paid penalties created more than ARCHIVE_AFTER_DAYS ago,
+# move to zstd-compressed `<collection>_archive` collections. Endpoints only
+# read the archive when called with include_archived=true.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", str(24 * 3600)))
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVED_COLLECTIONS = ["transactions", "messages", "user_activities", "notifications", "penalties"]
+
+async def create_archive_collections():
+    existing = set(await db.list_collection_names())
+    for name in ARCHIVED_COLLECTIONS:
+        if f"{name}_archive" in existing:
+            continue
+        try:
+            await db.create_collection(
+                f"{name}_archive",
+                storageEngine={"wiredTiger": {"configString": "block_compressor=zstd"}}
+            )
+        except OperationFailure:
+            # Some hosted tiers reject storage engine options; use the default compressor
+            await db.create_collection(f"{name}_archive")
+
+async def move_to_archive(collection: str, query: Dict[str, Any]) -> int:
+    """Copy matching documents to the archive, then delete them, in batches.
+
+    Safe to rerun after a crash: copies are upserts keyed on _id.
+    """
+    moved = 0
+    while True:
+        docs = await db[collection].find(query).limit(ARCHIVE_BATCH_SIZE).to_list(None)
+        if not docs:
+            return moved
+        await db[f"{collection}_archive"].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs],
+            ordered=False
+        )
+        await db[collection].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        moved += len(docs)
+        # Leave room for live traffic between batches
+        await asyncio.sleep(0.05)
+
+@periodic_job(ARCHIVE_INTERVAL_SECONDS)
+async def archive_cold_data():
+    cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    # Transactions with unpaid penalties stay until the penalty is settled
+    owed = await db.penalties.distinct("transaction_id", {"is_paid": False})
+    archived_transactions = 0
+    while True:
+        transactions = await db.transactions.find(
+            # updated_at is when it finished: a long rental is not archived on return
+            {
+                "status": {"$in": [TransactionStatus.COMPLETED, TransactionStatus.REJECTED]},
+                "updated_at": {"$lt": cutoff},
+                "id": {"$nin": owed}
+            },
+            {"id": 1}
+        ).limit(ARCHIVE_BATCH_SIZE).to_list(None)
+        if not transactions:
+            break
+        transaction_ids = [transaction["id"] for transaction in transactions]
+        # Dependents first, so a crash never leaves them without their transaction
+        await move_to_archive("messages", {"transaction_id": {"$in": transaction_ids}})
+        await move_to_archive("user_activities", {"transaction_id": {"$in": transaction_ids}})
+        archived_transactions += await move_to_archive("transactions", {"id": {"$in": transaction_ids}})
+    archived_notifications = await move_to_archive("notifications", {"is_read": True, "created_at": {"$lt": cutoff}})
+    archived_penalties = await move_to_archive("penalties", {"is_paid": True, "created_at": {"$lt": cutoff}})
+    if archived_transactions or archived_notifications or archived_penalties:
+        logger.info(
+            f"Archived {archived_transactions} transactions, {archived_notifications} notifications "
+            f"and {archived_penalties} penalties"
+        )
+
+async def find_with_archive(
+    collection: str,
+    query: Dict[str, Any],
+    sort: Tuple[str, int],
+    include_archived: bool = False,
+    limit: int = 0,
+    projection: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """Query a hot collection and, if requested, its archive, merged in `sort` order"""
+    sources = [db[collection]] + ([db[f"{collection}_archive"]] if include_archived else [])
+    results = await asyncio.gather(*[
+        source.find(query, projection).sort(*sort).limit(limit).to_list(None) for source in sources
+    ])
+    docs = [doc for result in results for doc in result]
+    if include_archived:
+        docs.sort(key=lambda doc: doc[sort[0]], reverse=sort[1] == -1)
+        if limit:
+            docs = docs[:limit]
+    return docs
+
+async def find_one_with_archive(collection: str, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    return await db[collection].find_one(query) or await db[f"{collection}_archive"].find_one(query)
+
+async def count_with_archive(collection: str, query: Dict[str, Any]) -> int:
+    counts = await asyncio.gather(
+        db[collection].count_documents(query),
+        db[f"{collection}_archive"].count_documents(query)
+    )
+    return sum(counts)
+
+# Schema migrations
+# Versioned backfills for fields added after documents were written. Each
+# migration walks its collection in _id order in batches, writes with
+# bulk_write, and checkpoints the last _id in `migrations`, so a restart
+# resumes where it stopped. Batches wait for majority acknowledgement and are
+# followed by a pause proportional to their duration, keeping the primary
+# (and replication) well below saturation while live traffic continues.
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "500"))
+# Fraction of wall time spent writing; 0.5 sleeps as long as each batch took
+MIGRATION_DUTY_CYCLE = float(os.getenv("MIGRATION_DUTY_CYCLE", "0.5"))
+# A replica running a migration holds a lease, renewed every batch
+MIGRATION_LEASE_SECONDS = 300
+migrations: List[Dict[str, Any]] = []
+migration_progress: Dict[str, Dict[str, Any]] = {}
+
+def migration(version: int, collection: str, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None):
+    """Register a backfill over documents of `collection` matching `query`.
+
+    The decorated coroutine receives a batch of documents and returns the
+    write operations for it. Live writes can land between the batch read and
+    its bulk_write, so each operation must repeat `query` in its filter to
+    become a no-op for documents that no longer need the backfill. Versions
+    run in ascending order, once.
+    """
+    def register(transform):
+        migrations.append({
+            "version": version,
+            "name": transform.__name__,
+            "collection": collection,
+            "query": query,
+            "projection": projection,
+            "transform": transform
+        })
+        return transform
+    return register
+
+async def claim_migration(spec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Take the lease on an unfinished migration, returning its checkpoint"""
+    now = datetime.now(timezone.utc)
+    try:
+        return await db.migrations.find_one_and_update(
+            {
+                "_id": spec["version"],
+                "status": {"$ne": "completed"},
+                "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}]
+            },
+            {
+                "$set": {"lease_until": now + timedelta(seconds=MIGRATION_LEASE_SECONDS), "status": "running"},
+                "$setOnInsert": {"name": spec["name"], "processed": 0, "started_at": now}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Completed, or leased by another replica
+        return None
+
+async def run_migration(spec: Dict[str, Any], state: Dict[str, Any]):
+    collection = db[spec["collection"]].with_options(write_concern=WriteConcern(w="majority"))
+    last_id, processed = state.get("last_id"), state["processed"]
+    progress = migration_progress.setdefault(spec["name"], {})
+    while True:
+        query = dict(spec["query"])
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        started = time.monotonic()
+        docs = await collection.find(query, spec["projection"]).sort("_id", 1).limit(MIGRATION_BATCH_SIZE).to_list(None)
+        if not docs:
+            break
+        operations = await spec["transform"](docs)
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+        last_id, processed = docs[-1]["_id"], processed + len(docs)
+        await db.migrations.update_one(
+            {"_id": spec["version"]},
+            {"$set": {
+                "last_id": last_id,
+                "processed": processed,
+                "lease_until": datetime.now(timezone.utc) + timedelta(seconds=MIGRATION_LEASE_SECONDS)
+            }}
+        )
+        progress.update(status="running", processed=processed)
+        elapsed = time.monotonic() - started
+        await asyncio.sleep(elapsed * (1 / MIGRATION_DUTY_CYCLE - 1))
+    await db.migrations.update_one(
+        {"_id": spec["version"]},
+        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc)}, "$unset": {"lease_until": ""}}
+    )
+    progress.update(status="completed", processed=processed)
+    logger.info(f"Migration {spec['version']} {spec['name']} completed ({processed} documents)")
+
+@background_worker
+async def run_migrations():
+    """Apply pending migrations in version order alongside live traffic"""
+    await ready_event.wait()
+    for spec in sorted(migrations, key=lambda spec: spec["version"]):
+        while True:
+            try:
+                state = await claim_migration(spec)
+                if state is None:
+                    done = await db.migrations.find_one({"_id": spec["version"], "status": "completed"})
+                    if done:
+                        break
+                    # Another replica holds the lease; later versions may
+                    # depend on this one, so wait for it
+                    await asyncio.sleep(MIGRATION_LEASE_SECONDS / 10)
+                    continue
+                await run_migration(spec, state)
+                break
+            except PyMongoError as e:
+                logger.error(f"Migration {spec['version']} {spec['name']} failed, retrying: {e}")
+                await asyncio.sleep(30)
+
+register_metrics("migrations", lambda: migration_progress)
+
+def updated_at_migration(version: int, collection: str, fallback: str):
+    """Start updated_at (used by /sync) at the document's creation time"""
+    async def transform(docs: List[Dict[str, Any]]) -> List[UpdateOne]:
+        now = datetime.now(timezone.utc)
+        return [
+            UpdateOne({"_id": doc["_id"], "updated_at": {"$exists": False}}, {"$set": {"updated_at": doc.get(fallback) or now}})
+            for doc in docs
+        ]
+    transform.__name__ = f"{collection}_updated_at"
+    migration(version, collection, {"updated_at": {"$exists": False}}, {"_id": 1, fallback: 1})(transform)
+
+updated_at_migration(1, "items", "created_at")
+updated_at_migration(2, "transactions", "created_at")
+updated_at_migration(3, "notifications", "created_at")
+updated_at_migration(4, "messages", "timestamp")
+
+@migration(5, "items", {"owner_location": {"$exists": False}}, {"_id": 1, "owner_id": 1})
+async def items_owner_location(docs: List[Dict[str, Any]]) -> List[UpdateOne]:
+    owner_ids = list({doc["owner_id"] for doc in docs})
+    locations = {
+        user["id"]: user.get("location")
+        for user in await db.users.find({"id": {"$in": owner_ids}}, {"id": 1, "location": 1}).to_list(None)
+    }
+    # Facet counters pick the new locations up at their next rebuild
+    return [
+        UpdateOne(
+            {"_id": doc["_id"], "owner_location": {"$exists": False}},
+            {"$set": {"owner_location": locations.get(doc["owner_id"])}}
+        )
+        for doc in docs
+    ]
+
+@migration(6, "users", {"token_version": {"$exists": False}}, {"_id": 1})
+async def users_token_version(docs: List[Dict[str, Any]]) -> List[UpdateOne]:
+    return [
+        UpdateOne({"_id": doc["_id"], "token_version": {"$exists": False}}, {"$set": {"token_version": 0}})
+        for doc in docs
+    ]
+
+@migration(7, "user_activities", {"item.image": {"$exists": True}}, {"_id": 1, "item.id": 1})
+async def user_activities_full_item(docs: List[Dict[str, Any]]) -> List[UpdateOne]:
+    # Activities briefly stored an item summary; /my-activities returns full items
+    item_ids = list({doc["item"]["id"] for doc in docs})
+    items = {item["id"]: item for item in await db.items.find({"id": {"$in": item_ids}}, {"_id": 0}).to_list(None)}
+    return [
+        UpdateOne(
+            {"_id": doc["_id"], "item.image": {"$exists": True}},
+            {"$set": {"item": activity_item(items[doc["item"]["id"]])}} if doc["item"]["id"] in items
+            else {"$unset": {"item": ""}}
+        )
+        for doc in docs
+    ]
+
+# Rate limiting
+# Token-bucket budgets per route as "capacity/period_seconds": a client may
+# burst `capacity` requests, refilled evenly over `period_seconds`. Override
+# with RATE_LIMIT_<ROUTE>, e.g. RATE_LIMIT_LOGIN="10/60". Anonymous requests
+# are keyed on the client IP, which uvicorn resolves from X-Forwarded-For for
+# the proxies listed in FORWARDED_ALLOW_IPS (see gunicorn.conf.py); without it
+# every client behind the load balancer would share one bucket.
+RATE_LIMITS = {
+    "login": "10/60",
+    "register": "5/60",
+    "refresh": "30/60",
+    "upload_images": "20/60",
+    "bulk_import": "5/300",
+    "items": "120/60",
+}
+# "memory" keeps buckets per worker process, "mongo" shares them across workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+def parse_rate_limit(spec: str) -> Tuple[int, float]:
+    """Parse "capacity/period_seconds" into (capacity, tokens refilled per second)"""
+    capacity, period = spec.split("/")
+    return int(capacity), int(capacity) / float(period)
+
+class RateLimitBackend(ABC):
+    """Storage for token buckets used by the rate_limit dependency"""
+
+    @abstractmethod
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> float:
+        """Take `cost` tokens from bucket `key`.
+
+        Returns 0 when the request is admitted, otherwise the number of
+        seconds until enough tokens will be available.
+        """
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time), least recently used first
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> float:
+        now = time.monotonic()
+        tokens, last = self.buckets.pop(key, (float(capacity), now))
+        tokens = min(capacity, tokens + (now - last) * refill_rate)
+        retry_after = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            retry_after = (cost - tokens) / refill_rate
+        self.buckets[key] = (tokens, now)
+        # Evict the longest idle buckets; they would mostly be full again anyway
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+class MongoRateLimitBackend(RateLimitBackend):
+    """Buckets in the `rate_limits` collection, updated atomically with an
+    update pipeline so every worker sees the same budget"""
+
+    async def consume(self, key: str, capacity: int, refill_rate: float, cost: int = 1) -> float:
+        now = time.time()
+        # Documents expire once an idle bucket would be full again
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=capacity / refill_rate)
+        bucket = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": {"$min": [capacity, {"$add": [
+                        {"$ifNull": ["$tokens", capacity]},
+                        {"$multiply": [{"$subtract": [now, {"$ifNull": ["$ts", now]}]}, refill_rate]}
+                    ]}]},
+                    "ts": now
+                }},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "expires_at": expires_at
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (cost - bucket["tokens"]) / refill_rate
+
+rate_limiter: RateLimitBackend = (
+    MongoRateLimitBackend() if RATE_LIMIT_BACKEND == "mongo" else InMemoryRateLimitBackend()
+)
+
+def rate_limit_key(request: Request) -> str:
+    """Identify the caller by user id from a valid bearer token, else by IP.
+
+    The token is only decoded, never looked up, so throttled clients are shed
+    before any database work.
+    """
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}"
+        except jwt.PyJWTError:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def rate_limit(route: str):
+    """Dependency enforcing the RATE_LIMITS budget of `route`"""
+    capacity, refill_rate = parse_rate_limit(os.getenv(f"RATE_LIMIT_{route.upper()}", RATE_LIMITS[route]))
+
+    async def check_rate_limit(request: Request):
+        retry_after = await rate_limiter.consume(f"{route}:{rate_limit_key(request)}", capacity, refill_rate)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+    return check_rate_limit
 
 # Authentication Routes
-@api_router.post("/auth/register")
+@api_router.post("/auth/register", dependencies=[Depends(rate_limit("register"))])
 async def register(user_data: UserCreate):
     # Check if user exists
     existing_user = await db.users.find_one({"$or": [{"email": user_data.email}, {"username": user_data.username}]})
@@ -342,54 +1762,1166 @@ async def register(user_data: UserCreate):
     user_dict["password"] = hashed_password
     await db.users.insert_one(user_dict)
     
-    # Create access token
-    access_token = create_access_token(data={"sub": user.id})
+    # Create access and refresh tokens
+    return {**create_token_pair(user_dict), "user": UserProfile(**user.dict())}
+
+@api_router.post("/auth/login", dependencies=[Depends(rate_limit("login"))])
+async def login(user_data: UserLogin):
+    # Find user
+    user = await db.users.find_one({"$or": [{"email": user_data.email_or_username}, {"username": user_data.email_or_username}]})
+    if not user or not verify_password(user_data.password, user["password"]):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    if user.get("is_banned", False):
+        raise HTTPException(status_code=403, detail="Account is banned")
+    
+    # Create access and refresh tokens
+    return {**create_token_pair(user), "user": UserProfile(**user)}
+
+@api_router.post("/auth/refresh", dependencies=[Depends(rate_limit("refresh"))])
+async def refresh_tokens(token_data: TokenRefresh):
+    payload = decode_token(token_data.refresh_token, token_type="refresh")
+    user = await db.users.find_one({"id": payload["sub"]})
+    if not user or user.get("token_version", 0) != payload.get("ver", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    if user.get("is_banned", False):
+        raise HTTPException(status_code=403, detail="Account is banned")
+    return create_token_pair(user)
+
+@api_router.get("/auth/me", response_model=UserProfile)
+async def get_me(current_user: User = Depends(get_current_user)):
+    return UserProfile(**current_user.dict())
+
+# Image processing
+# Longest edge in pixels of each rendition generated on upload
+IMAGE_RENDITIONS = {"thumb": 240, "medium": 1024}
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))
+image_pool = None
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """Process pool for Pillow work, created on first upload"""
+    global image_pool
+    if image_pool is None:
+        image_pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS)
+    return image_pool
+
+def render_image(data: bytes) -> Dict[str, bytes]:
+    """Validate image bytes and encode every IMAGE_RENDITIONS size as WebP.
+
+    Runs in the image process pool. Raises ValueError when the bytes are not
+    a decodable image, whatever content type the client claimed, or would
+    decode to more than Pillow's MAX_IMAGE_PIXELS limit (a decompression bomb).
+    """
+    # Imported here so only the image worker processes load Pillow
+    from PIL import Image, ImageOps, UnidentifiedImageError
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ValueError(f"Invalid image: {e}")
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    renditions = {}
+    for name, size in IMAGE_RENDITIONS.items():
+        rendition = image.copy()
+        rendition.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        rendition.save(buffer, format="WEBP", quality=80, method=4)
+        renditions[name] = buffer.getvalue()
+    return renditions
+
+def upload_asset(data: bytes, public_id: str) -> str:
+    """Upload bytes to Cloudinary under a fixed public_id and return its URL"""
+    result = get_cloudinary().uploader.upload(io.BytesIO(data), public_id=public_id, overwrite=False)
+    return result["secure_url"]
+
+async def store_image(data: bytes, user_id: str) -> Dict[str, Any]:
+    """Return the stored asset for these image bytes, processing and
+    uploading them only if this exact content was never uploaded before"""
+    content_hash = hashlib.sha256(data).hexdigest()
+    asset = await db.image_assets.find_one_and_update(
+        {"hash": content_hash},
+        {"$set": {"last_used_at": datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if asset:
+        # The asset may have been queued for deletion with its last item
+        await db.image_deletions.delete_many({"$or": [
+            {"url": {"$in": [asset[name] for name in ("original", *IMAGE_RENDITIONS) if asset.get(name)]}},
+            {"public_id": {"$in": asset["public_ids"]}}
+        ]})
+        return asset
+
+    loop = asyncio.get_running_loop()
+    try:
+        renditions = await loop.run_in_executor(get_image_pool(), render_image, data)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Only image files are allowed")
+
+    # Content-addressed public ids: the same bytes always map to the same assets
+    folder = f"assets/{content_hash[:2]}/{content_hash}"
+    uploads = {"original": data, **renditions}
+    urls = await asyncio.gather(*[
+        asyncio.to_thread(upload_asset, payload, f"{folder}/{name}")
+        for name, payload in uploads.items()
+    ])
+    asset = {
+        "hash": content_hash,
+        "uploaded_by": user_id,
+        "public_ids": [f"{folder}/{name}" for name in uploads],
+        "size": len(data),
+        "created_at": datetime.now(timezone.utc),
+        "last_used_at": datetime.now(timezone.utc),
+        **dict(zip(uploads, urls))
+    }
+    # A concurrent upload of the same bytes may have won the race
+    await db.image_assets.update_one({"hash": content_hash}, {"$setOnInsert": asset}, upsert=True)
+    return asset
+
+async def get_thumbnails(images: List[str]) -> List[str]:
+    """Thumbnail URLs matching `images`, falling back to the image itself for
+    images that were not uploaded through the rendition pipeline"""
+    assets = await db.image_assets.find({"medium": {"$in": images}}, {"medium": 1, "thumb": 1}).to_list(None)
+    thumbs = {asset["medium"]: asset["thumb"] for asset in assets}
+    return [thumbs.get(url, url) for url in images]
+
+# Image garbage collection
+# Deleting an item only enqueues its images in `image_deletions`; the worker
+# below removes them from Cloudinary in batches, off the request path.
+IMAGE_GC_INTERVAL_SECONDS = float(os.getenv("IMAGE_GC_INTERVAL_SECONDS", "30"))
+IMAGE_GC_BATCH_SIZE = 100  # Cloudinary delete_resources accepts up to 100 ids
+IMAGE_GC_MAX_ATTEMPTS = 8
+IMAGE_GC_LEASE_SECONDS = 300
+IMAGE_ORPHAN_SWEEP_INTERVAL_SECONDS = float(os.getenv("IMAGE_ORPHAN_SWEEP_INTERVAL_SECONDS", str(6 * 3600)))
+# Uploads (including re-uploads of known content, which bump last_used_at)
+# happen before the item is created; give clients time to finish
+IMAGE_ORPHAN_GRACE_SECONDS = float(os.getenv("IMAGE_ORPHAN_GRACE_SECONDS", str(24 * 3600)))
+
+CLOUDINARY_PUBLIC_ID_RE = re.compile(r"/upload/(?:[^/]*,[^/]*/)*(?:v\d+/)?(?P<public_id>.+?)(?:\.[A-Za-z0-9]+)?$")
+
+def cloudinary_public_id(url: str) -> Optional[str]:
+    """Extract the public_id (including folders) from a Cloudinary delivery URL"""
+    match = CLOUDINARY_PUBLIC_ID_RE.search(url.split("?")[0])
+    return match.group("public_id") if match else None
+
+async def enqueue_image_deletions(urls: List[str] = (), public_ids: List[str] = ()):
+    """Queue images for deletion by URL or by Cloudinary public_id"""
+    now = datetime.now(timezone.utc)
+    jobs = [{"url": url} for url in urls] + [{"public_id": public_id} for public_id in public_ids]
+    if not jobs:
+        return
+    for job in jobs:
+        job.update({"id": str(uuid.uuid4()), "attempts": 0, "next_attempt_at": now, "last_error": None, "created_at": now})
+    await db.image_deletions.insert_many(jobs, ordered=False)
+
+async def claim_image_deletions() -> List[Dict[str, Any]]:
+    """Lease up to IMAGE_GC_BATCH_SIZE due jobs so other workers skip them.
+
+    A worker that dies mid-batch simply lets the lease run out.
+    """
+    jobs = []
+    now = datetime.now(timezone.utc)
+    while len(jobs) < IMAGE_GC_BATCH_SIZE:
+        job = await db.image_deletions.find_one_and_update(
+            {"next_attempt_at": {"$lte": now}, "attempts": {"$lt": IMAGE_GC_MAX_ATTEMPTS}},
+            {"$set": {"next_attempt_at": now + timedelta(seconds=IMAGE_GC_LEASE_SECONDS)}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            break
+        jobs.append(job)
+    return jobs
+
+async def resolve_image_deletion(job: Dict[str, Any]) -> Optional[List[str]]:
+    """Public ids to delete for a job, or None when the image is still in use"""
+    if job.get("public_id"):
+        return [job["public_id"]]
+    url = job["url"]
+    # Deduplicated assets may be shared by several items
+    if await db.items.count_documents({"images": url}, limit=1):
+        return None
+    asset = await db.image_assets.find_one({"$or": [{"medium": url}, {"thumb": url}, {"original": url}]})
+    if asset:
+        # Uploaded again after the job was queued: the new item will use it
+        last_used_at = asset.get("last_used_at")
+        if last_used_at and last_used_at.replace(tzinfo=timezone.utc) > job["created_at"].replace(tzinfo=timezone.utc):
+            return None
+        return asset["public_ids"]
+    public_id = cloudinary_public_id(url)
+    return [public_id] if public_id else []
+
+@periodic_job(IMAGE_GC_INTERVAL_SECONDS)
+async def process_image_deletions():
+    """Delete queued images from Cloudinary, retrying failures with backoff"""
+    while True:
+        jobs = await claim_image_deletions()
+        if not jobs:
+            return
+        public_ids_by_job = {}
+        for job in jobs:
+            public_ids = await resolve_image_deletion(job)
+            if public_ids is None:
+                await db.image_deletions.delete_one({"id": job["id"]})
+            else:
+                public_ids_by_job[job["id"]] = public_ids
+
+        all_public_ids = [pid for ids in public_ids_by_job.values() for pid in ids]
+        failed = {}
+        for i in range(0, len(all_public_ids), IMAGE_GC_BATCH_SIZE):
+            chunk = all_public_ids[i:i + IMAGE_GC_BATCH_SIZE]
+            try:
+                result = await asyncio.to_thread(get_cloudinary().api.delete_resources, chunk)
+                for public_id, outcome in result.get("deleted", {}).items():
+                    if outcome not in ("deleted", "not_found"):
+                        failed[public_id] = outcome
+            except Exception as e:
+                failed.update({public_id: str(e) for public_id in chunk})
+
+        now = datetime.now(timezone.utc)
+        for job in jobs:
+            if job["id"] not in public_ids_by_job:
+                continue
+            errors = [failed[pid] for pid in public_ids_by_job[job["id"]] if pid in failed]
+            if not errors:
+                await db.image_assets.delete_many({"public_ids": {"$in": public_ids_by_job[job["id"]]}})
+                await db.image_deletions.delete_one({"id": job["id"]})
+                continue
+            attempts = job["attempts"] + 1
+            if attempts >= IMAGE_GC_MAX_ATTEMPTS:
+                logger.error(f"Giving up deleting image {job.get('url') or job.get('public_id')}: {errors[0]}")
+            await db.image_deletions.update_one(
+                {"id": job["id"]},
+                {"$set": {
+                    "attempts": attempts,
+                    "last_error": errors[0],
+                    "next_attempt_at": now + timedelta(seconds=min(2 ** attempts * 30, 6 * 3600))
+                }}
+            )
+
+@periodic_job(IMAGE_ORPHAN_SWEEP_INTERVAL_SECONDS)
+async def sweep_orphan_images():
+    """Queue stored assets that no item references any more, and Cloudinary
+    resources under assets/ that have no image_assets record"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=IMAGE_ORPHAN_GRACE_SECONDS)
+    orphans = []
+    idle = {"$or": [
+        {"last_used_at": {"$lt": cutoff}},
+        {"last_used_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+    ]}
+    async for asset in db.image_assets.find(idle, {"medium": 1}):
+        if not await db.items.count_documents({"images": asset["medium"]}, limit=1):
+            orphans.append(asset["medium"])
+    await enqueue_image_deletions(urls=orphans)
+
+    known_hashes = set(await db.image_assets.distinct("hash"))
+    untracked = []
+    next_cursor = None
+    while True:
+        options = {"type": "upload", "prefix": "assets/", "max_results": 500}
+        if next_cursor:
+            options["next_cursor"] = next_cursor
+        page = await asyncio.to_thread(get_cloudinary().api.resources, **options)
+        for resource in page.get("resources", []):
+            created_at = datetime.fromisoformat(resource["created_at"].replace("Z", "+00:00"))
+            content_hash = resource["public_id"].split("/")[2]
+            if content_hash not in known_hashes and created_at < cutoff:
+                untracked.append(resource["public_id"])
+        next_cursor = page.get("next_cursor")
+        if not next_cursor:
+            break
+    await enqueue_image_deletions(public_ids=untracked)
+    if orphans or untracked:
+        logger.info(f"Image sweep queued {len(orphans)} orphan assets and {len(untracked)} untracked resources")
+
+# File Upload Route (IMPROVED)
+@api_router.post("/upload-images", dependencies=[Depends(rate_limit("upload_images"))])
+async def upload_images(
+    files: list[UploadFile] = File(...),
+    current_user: TokenUser = Depends(get_token_user)  # IMPROVED: Use correct type
+):
+    if len(files) < 1 or len(files) > 5:
+        raise HTTPException(status_code=400, detail="You must upload between 1 and 5 images")
+    
+    uploaded_files = []
+    thumbnails = []
+    for file in files:
+        if not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="Only image files are allowed")
+        
+        data = await file.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail="Image is too large")
+        
+        asset = await store_image(data, current_user.id)
+        # Items reference the medium rendition; originals stay in image_assets
+        uploaded_files.append(asset["medium"])
+        thumbnails.append(asset["thumb"])
     
-    return {"access_token": access_token, "token_type": "bearer", "user": UserProfile(**user.dict())}
+    return {"uploaded_files": uploaded_files, "thumbnails": thumbnails}
+
+
+# Catalog facets
+# Counts of available items per category, owner location and token price
+# bucket. Kept up to date incrementally by the item routes and rebuilt
+# periodically from a $facet aggregation to correct any drift.
+TOKEN_PRICE_BOUNDARIES = [0, 5, 10, 25, 50, 100]
+CATALOG_FACETS_REBUILD_SECONDS = float(os.getenv("CATALOG_FACETS_REBUILD_SECONDS", "3600"))
+UNKNOWN_LOCATION = "Unknown"
+
+def token_price_bucket(token_per_day: int) -> str:
+    """Label of the TOKEN_PRICE_BOUNDARIES bucket containing `token_per_day`"""
+    if token_per_day < TOKEN_PRICE_BOUNDARIES[0] or token_per_day >= TOKEN_PRICE_BOUNDARIES[-1]:
+        return f"{TOKEN_PRICE_BOUNDARIES[-1]}+"
+    for low, high in zip(TOKEN_PRICE_BOUNDARIES, TOKEN_PRICE_BOUNDARIES[1:]):
+        if token_per_day < high:
+            return f"{low}-{high - 1}"
+
+def item_facet_keys(item: Dict[str, Any]) -> List[Tuple[str, str]]:
+    return [
+        ("category", item["category"]),
+        ("location", item.get("owner_location") or UNKNOWN_LOCATION),
+        ("token_price", token_price_bucket(item["token_per_day"])),
+    ]
+
+async def adjust_catalog_facets(item: Dict[str, Any], delta: int):
+    """Add `delta` to the facet counters of an available item"""
+    await adjust_catalog_facets_many([item], delta)
+
+async def adjust_catalog_facets_many(items: List[Dict[str, Any]], delta: int):
+    """Add `delta` per available item to the facet counters, one write per counter"""
+    increments = Counter(
+        facet_key
+        for item in items if item.get("is_available", True)
+        for facet_key in item_facet_keys(item)
+    )
+    if not increments:
+        return
+    await db.catalog_facets.bulk_write([
+        UpdateOne(
+            {"_id": f"{facet}:{value}"},
+            {"$inc": {"count": delta * count}, "$set": {"facet": facet, "value": value}},
+            upsert=True
+        )
+        for (facet, value), count in increments.items()
+    ], ordered=False)
+
+def catalog_facets_pipeline(query: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"$match": query},
+        {"$facet": {
+            "category": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+            "location": [{"$group": {"_id": {"$ifNull": ["$owner_location", UNKNOWN_LOCATION]}, "count": {"$sum": 1}}}],
+            "token_price": [{"$bucket": {
+                "groupBy": "$token_per_day",
+                "boundaries": TOKEN_PRICE_BOUNDARIES,
+                "default": f"{TOKEN_PRICE_BOUNDARIES[-1]}+",
+                "output": {"count": {"$sum": 1}}
+            }}],
+        }}
+    ]
+
+def facet_bucket_label(facet: str, value) -> str:
+    # $bucket reports the lower boundary as the bucket id
+    if facet == "token_price" and isinstance(value, int):
+        return token_price_bucket(value)
+    return value
+
+def format_catalog_facets(counts: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    categories = {category: counts["category"].get(category, 0) for category in CATEGORIES}
+    return {
+        "categories": categories,
+        "locations": dict(sorted(counts["location"].items(), key=lambda kv: -kv[1])),
+        "token_price": {
+            label: counts["token_price"].get(label, 0)
+            for label in [token_price_bucket(low) for low in TOKEN_PRICE_BOUNDARIES]
+        },
+        "total": sum(categories.values()),
+    }
+
+@periodic_job(CATALOG_FACETS_REBUILD_SECONDS)
+async def rebuild_catalog_facets():
+    """Recompute the facet counters from the items collection"""
+    result = await db.items.aggregate(catalog_facets_pipeline({"is_available": True})).to_list(None)
+    counters = {}
+    for facet, buckets in result[0].items():
+        for bucket in buckets:
+            value = facet_bucket_label(facet, bucket["_id"])
+            counters[f"{facet}:{value}"] = {"facet": facet, "value": value, "count": bucket["count"]}
+    for key, counter in counters.items():
+        await db.catalog_facets.update_one({"_id": key}, {"$set": counter}, upsert=True)
+    await db.catalog_facets.update_many({"_id": {"$nin": list(counters)}}, {"$set": {"count": 0}})
+
+# Token pricing
+# Suggestions come from what similar items actually charge: per category
+# quantiles of tokens per day per ₹1000 of value, nudged by demand (recent
+# borrows per listing). Statistics are rebuilt periodically into NumPy arrays
+# and updated in place as items and borrow requests come in.
+PRICE_MODEL_REFRESH_SECONDS = float(os.getenv("PRICE_MODEL_REFRESH_SECONDS", "900"))
+PRICE_MODEL_DEMAND_WINDOW_DAYS = 90
+PRICE_MODEL_MIN_SAMPLES = 5  # Below this the category falls back to calculate_token_value
+PRICE_MODEL_MAX_SAMPLES = 5000
+
+class TokenPriceModel:
+    QUANTILES = np.array([0.25, 0.5, 0.75])
+
+    def __init__(self):
+        self.category_index = {category: i for i, category in enumerate(CATEGORIES)}
+        # Tokens per day per ₹1000 of value, newest last
+        self.samples = [np.empty(0) for _ in CATEGORIES]
+        self.quantiles = np.full((len(CATEGORIES), len(self.QUANTILES)), np.nan)
+        self.listings = np.zeros(len(CATEGORIES))
+        self.borrows = np.zeros(len(CATEGORIES))
+        self.demand = np.ones(len(CATEGORIES))
+        self.built_at: Optional[datetime] = None
+
+    def load(self, items: List[Dict[str, Any]], borrows: Dict[str, int]):
+        """Rebuild all statistics from item documents and per-category borrow counts"""
+        categories = np.array([self.category_index.get(item["category"], -1) for item in items], dtype=np.int64)
+        values = np.array([item["value"] for item in items], dtype=np.float64)
+        tokens = np.array([item["token_per_day"] for item in items], dtype=np.float64)
+        priced = (categories >= 0) & (values > 0) & (tokens > 0)
+        ratios = tokens[priced] / (values[priced] / 1000)
+        categories = categories[priced]
+        self.listings = np.bincount(categories, minlength=len(CATEGORIES)).astype(np.float64)
+        self.samples = [ratios[categories == i][-PRICE_MODEL_MAX_SAMPLES:] for i in range(len(CATEGORIES))]
+        for i in range(len(CATEGORIES)):
+            self._update_quantiles(i)
+        self.borrows = np.array([borrows.get(category, 0) for category in CATEGORIES], dtype=np.float64)
+        self._update_demand()
+        self.built_at = datetime.now(timezone.utc)
+
+    def add_item(self, category: str, value: int, token_per_day: int):
+        i = self.category_index.get(category)
+        if i is None or value <= 0 or token_per_day <= 0:
+            return
+        self.samples[i] = np.append(self.samples[i], token_per_day / (value / 1000))[-PRICE_MODEL_MAX_SAMPLES:]
+        self.listings[i] += 1
+        self._update_quantiles(i)
+        self._update_demand()
+
+    def add_borrow(self, category: str):
+        i = self.category_index.get(category)
+        if i is None:
+            return
+        self.borrows[i] += 1
+        self._update_demand()
+
+    def _update_quantiles(self, i: int):
+        if len(self.samples[i]) >= PRICE_MODEL_MIN_SAMPLES:
+            self.quantiles[i] = np.quantile(self.samples[i], self.QUANTILES)
+        else:
+            self.quantiles[i] = np.nan
+
+    def _update_demand(self):
+        # Borrows per listing relative to the platform average, damped and
+        # clipped so demand nudges prices rather than dominating them
+        per_listing = (self.borrows + 1) / (self.listings + 1)
+        overall = (self.borrows.sum() + 1) / (self.listings.sum() + 1)
+        self.demand = np.clip(np.sqrt(per_listing / overall), 0.8, 1.25)
+
+    def suggest(self, value: int, category: str) -> Optional[Dict[str, Any]]:
+        """Suggested tokens per day with a typical range, or None when the
+        category has too little market data"""
+        i = self.category_index.get(category)
+        if i is None or value <= 0 or np.isnan(self.quantiles[i, 0]):
+            return None
+        low, median, high = np.maximum(1, np.rint(self.quantiles[i] * (value / 1000) * self.demand[i])).astype(int)
+        return {
+            "suggested_tokens": int(median),
+            "range": [int(low), int(high)],
+            "demand": round(float(self.demand[i]), 2),
+            "samples": len(self.samples[i]),
+        }
+
+token_price_model = TokenPriceModel()
+
+# Every replica folds new listings and borrow requests into its own model
+@event_bus.subscribe("item.changed")
+async def price_model_on_item_changed(event: Dict[str, Any]):
+    if event["operation"] == "insert":
+        item = event["document"]
+        token_price_model.add_item(item["category"], item["value"], item["token_per_day"])
+
+@event_bus.subscribe("transaction.status_changed")
+async def price_model_on_transaction_changed(event: Dict[str, Any]):
+    if event["operation"] == "insert":
+        item = await read_db.items.find_one({"id": event["document"]["item_id"]}, {"category": 1})
+        if item:
+            token_price_model.add_borrow(item["category"])
+
+@periodic_job(PRICE_MODEL_REFRESH_SECONDS)
+async def refresh_token_price_model():
+    """Rebuild the token price model from items and recent transactions"""
+    items = await read_db.items.find({}, {"_id": 0, "category": 1, "value": 1, "token_per_day": 1}).to_list(None)
+    since = datetime.now(timezone.utc) - timedelta(days=PRICE_MODEL_DEMAND_WINDOW_DAYS)
+    borrow_counts = await read_db.transactions.aggregate([
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$group": {"_id": "$item_id", "count": {"$sum": 1}}},
+        {"$lookup": {"from": "items", "localField": "_id", "foreignField": "id", "as": "item"}},
+        {"$unwind": "$item"},
+        {"$group": {"_id": "$item.category", "count": {"$sum": "$count"}}}
+    ]).to_list(None)
+    token_price_model.load(items, {bucket["_id"]: bucket["count"] for bucket in borrow_counts})
+
+# Item recommendations
+# "People who borrowed this also borrowed": cosine similarity between items
+# over the binary borrower x item matrix of completed transactions. A batch
+# job stores the top RECOMMENDATION_TOP_K neighbors of every item in
+# `item_neighbors`; completed transactions are queued in `co_borrow_queue`
+# and a short-interval job updates the affected pairs in place, keeping that
+# work off the return request.
+RECOMMENDATIONS_REBUILD_SECONDS = float(os.getenv("RECOMMENDATIONS_REBUILD_SECONDS", str(6 * 3600)))
+CO_BORROW_QUEUE_SECONDS = float(os.getenv("CO_BORROW_QUEUE_SECONDS", "30"))
+RECOMMENDATION_TOP_K = 50
+
+def top_neighbors(neighbors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    neighbors.sort(key=lambda neighbor: (-neighbor["score"], -neighbor["count"]))
+    return neighbors[:RECOMMENDATION_TOP_K]
+
+@periodic_job(RECOMMENDATIONS_REBUILD_SECONDS)
+async def rebuild_item_neighbors():
+    """Recompute item-item co-borrow similarity from all completed transactions"""
+    from scipy import sparse  # Only this job needs SciPy; keep it out of startup
+    completed = {"$match": {"status": TransactionStatus.COMPLETED}}
+    pairs = await read_db.transactions.aggregate([
+        completed,
+        {"$unionWith": {"coll": "transactions_archive", "pipeline": [completed]}},
+        {"$group": {"_id": {"borrower_id": "$borrower_id", "item_id": "$item_id"}}}
+    ]).to_list(None)
+    if not pairs:
+        return
+    user_ids, user_index = np.unique([pair["_id"]["borrower_id"] for pair in pairs], return_inverse=True)
+    item_ids, item_index = np.unique([pair["_id"]["item_id"] for pair in pairs], return_inverse=True)
+    borrowed = sparse.csr_matrix(
+        (np.ones(len(pairs)), (user_index, item_index)),
+        shape=(len(user_ids), len(item_ids))
+    )
+    co_counts = (borrowed.T @ borrowed).tocsr()
+    co_counts.setdiag(0)
+    co_counts.eliminate_zeros()
+    borrowers = np.asarray(borrowed.sum(axis=0)).ravel()
+    inverse_norm = sparse.diags(1 / np.sqrt(borrowers))
+    similarity = (inverse_norm @ co_counts @ inverse_norm).tocsr()
+
+    built_at = datetime.now(timezone.utc)
+    operations = []
+    for i, item_id in enumerate(item_ids):
+        start, end = similarity.indptr[i], similarity.indptr[i + 1]
+        columns, scores = similarity.indices[start:end], similarity.data[start:end]
+        counts = co_counts[i, columns].toarray().ravel()
+        if len(scores) > RECOMMENDATION_TOP_K:
+            keep = np.argpartition(-scores, RECOMMENDATION_TOP_K)[:RECOMMENDATION_TOP_K]
+            columns, scores, counts = columns[keep], scores[keep], counts[keep]
+        neighbors = top_neighbors([
+            {"item_id": str(item_ids[j]), "score": float(score), "count": int(count)}
+            for j, score, count in zip(columns, scores, counts)
+        ])
+        operations.append(UpdateOne(
+            {"item_id": str(item_id)},
+            {"$set": {"borrowers": int(borrowers[i]), "neighbors": neighbors, "built_at": built_at}},
+            upsert=True
+        ))
+        if len(operations) >= 1000:
+            await db.item_neighbors.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await db.item_neighbors.bulk_write(operations, ordered=False)
+    await db.item_neighbors.delete_many({"built_at": {"$lt": built_at}})
+
+async def record_co_borrow(transaction: Dict[str, Any]):
+    """Fold a newly completed transaction into the neighbor index.
+
+    Counts are bumped with atomic updates, so concurrent completions do not
+    overwrite each other. Only the scores of the pairs involving this item
+    are recomputed; its other neighbors refresh at the next batch rebuild.
+    Documents created here carry `built_at` so that rebuild can replace them.
+    """
+    item_id = transaction["item_id"]
+    earlier = {
+        "borrower_id": transaction["borrower_id"],
+        "status": TransactionStatus.COMPLETED,
+        "id": {"$ne": transaction["id"]}
+    }
+    history = set(await db.transactions.distinct("item_id", earlier))
+    history |= set(await db.transactions_archive.distinct("item_id", earlier))
+    if item_id in history:
+        return  # The matrix is binary: repeat borrows add nothing
+    now = datetime.now(timezone.utc)
+    doc = await db.item_neighbors.find_one_and_update(
+        {"item_id": item_id},
+        {"$inc": {"borrowers": 1}, "$setOnInsert": {"neighbors": [], "built_at": now}},
+        projection={"_id": 0, "borrowers": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    # Borrowed items without a document yet have at least this borrower
+    borrowers = {other_id: 1 for other_id in history}
+    async for other in db.item_neighbors.find({"item_id": {"$in": list(history)}}, {"_id": 0, "item_id": 1, "borrowers": 1}):
+        borrowers[other["item_id"]] = other.get("borrowers") or 1
+    borrowers[item_id] = doc["borrowers"]
+
+    async def bump(doc_id: str, other_id: str):
+        def score(count: int) -> float:
+            return count / math.sqrt(borrowers[doc_id] * borrowers[other_id])
+        while True:
+            bumped = await db.item_neighbors.find_one_and_update(
+                {"item_id": doc_id, "neighbors.item_id": other_id},
+                {"$inc": {"neighbors.$.count": 1}},
+                projection={"_id": 0, "neighbors.$": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if bumped:
+                await db.item_neighbors.update_one(
+                    {"item_id": doc_id},
+                    {"$set": {"neighbors.$[neighbor].score": score(bumped["neighbors"][0]["count"])}},
+                    array_filters=[{"neighbor.item_id": other_id}]
+                )
+                # An empty $push only re-sorts the array
+                await db.item_neighbors.update_one(
+                    {"item_id": doc_id},
+                    {"$push": {"neighbors": {"$each": [], "$sort": {"score": -1, "count": -1}}}}
+                )
+                return
+            try:
+                # New pair: add it and keep the top RECOMMENDATION_TOP_K by score
+                await db.item_neighbors.update_one(
+                    {"item_id": doc_id, "neighbors.item_id": {"$ne": other_id}},
+                    {
+                        "$push": {"neighbors": {
+                            "$each": [{"item_id": other_id, "score": score(1), "count": 1}],
+                            "$sort": {"score": -1, "count": -1},
+                            "$slice": RECOMMENDATION_TOP_K
+                        }},
+                        "$setOnInsert": {"borrowers": 1, "built_at": now}
+                    },
+                    upsert=True
+                )
+                return
+            except DuplicateKeyError:
+                continue  # Another completion added the pair first; bump it
+
+    await asyncio.gather(
+        *[bump(item_id, other_id) for other_id in history],
+        *[bump(other_id, item_id) for other_id in history]
+    )
+
+async def enqueue_co_borrow(transaction: Dict[str, Any]):
+    """Queue a completed transaction for record_co_borrow"""
+    try:
+        await db.co_borrow_queue.insert_one({
+            "transaction_id": transaction["id"],
+            "item_id": transaction["item_id"],
+            "borrower_id": transaction["borrower_id"],
+            "created_at": datetime.now(timezone.utc)
+        })
+    except PyMongoError as e:
+        # Recommendations only; the next batch rebuild picks the transaction up
+        logger.error(f"Could not queue transaction {transaction['id']} for recommendations: {e}")
+
+@periodic_job(CO_BORROW_QUEUE_SECONDS)
+async def process_co_borrow_queue():
+    """Fold queued completed transactions into the neighbor index"""
+    # Claimed by deleting, so each entry is processed by one replica only
+    while entry := await db.co_borrow_queue.find_one_and_delete({}, sort=[("created_at", 1)]):
+        try:
+            await record_co_borrow({
+                "id": entry["transaction_id"], "item_id": entry["item_id"], "borrower_id": entry["borrower_id"]
+            })
+        except PyMongoError as e:
+            logger.error(f"Co-borrow update for transaction {entry['transaction_id']} failed: {e}")
+
+async def fetch_available_items(item_ids: List[str], limit: int, exclude_owner: Optional[str] = None) -> List[Item]:
+    """Available items for `item_ids`, kept in the given order"""
+    query = {"id": {"$in": item_ids}, "is_available": True}
+    if exclude_owner:
+        query["owner_id"] = {"$ne": exclude_owner}
+    items = {item["id"]: item for item in await read_db.items.find(query).to_list(None)}
+    return [Item(**items[item_id]) for item_id in item_ids if item_id in items][:limit]
+
+# Request coalescing
+# Concurrent identical reads share one in-flight query, and its result is
+# reused for MICRO_CACHE_TTL_MS afterwards. Writes elsewhere show up after at
+# most that long; item changes are also invalidated through the event bus.
+MICRO_CACHE_TTL_MS = float(os.getenv("MICRO_CACHE_TTL_MS", "250"))
+
+class SingleFlight:
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        # key -> (expires at, value), oldest first
+        self.cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.executions = 0
+        register_metrics(f"single_flight.{name}", self.metrics)
+
+    async def do(self, key: str, fetch):
+        """Return the result of `fetch()` for `key`, sharing work with
+        concurrent and very recent callers. Callers must not mutate it."""
+        self.requests += 1
+        cached = self.cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.cache_hits += 1
+            return cached[1]
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, fetch))
+            self.in_flight[key] = task
+        else:
+            self.coalesced += 1
+        # Shielded so one cancelled caller does not cancel the shared query
+        return await asyncio.shield(task)
+
+    async def _run(self, key: str, fetch):
+        self.executions += 1
+        try:
+            value = await fetch()
+            self.cache[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+            return value
+        finally:
+            del self.in_flight[key]
+
+    def invalidate(self, key: str):
+        self.cache.pop(key, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "executions": self.executions,
+            "dedup_ratio": round(1 - self.executions / self.requests, 4) if self.requests else 0.0,
+            "cached_keys": len(self.cache),
+        }
+
+item_reads = SingleFlight("items", MICRO_CACHE_TTL_MS / 1000)
+review_reads = SingleFlight("reviews", MICRO_CACHE_TTL_MS / 1000)
+
+@event_bus.subscribe("item.changed")
+async def item_reads_on_item_changed(event: Dict[str, Any]):
+    if event["id"]:
+        item_reads.invalidate(event["id"])
+
+# Autocomplete
+# Typeahead over available item titles and usernames from sorted, blocked
+# arrays of normalized keys held in memory: a lookup is two binary searches
+# plus a short scan. Titles are indexed from the start of each of their first few words so
+# "bike" finds "Mountain bike". Rebuilt periodically, updated from events.
+AUTOCOMPLETE_REBUILD_SECONDS = float(os.getenv("AUTOCOMPLETE_REBUILD_SECONDS", "3600"))
+AUTOCOMPLETE_MAX_WORDS = 4
+AUTOCOMPLETE_BLOCK_SIZE = 1000
+AUTOCOMPLETE_MAX_RESULTS = 20
+
+def normalize_autocomplete(text: str) -> str:
+    """Lowercase, strip accents and collapse whitespace"""
+    text = text.casefold()
+    if not text.isascii():
+        decomposed = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+def autocomplete_keys(kind: str, text: str) -> List[str]:
+    normalized = normalize_autocomplete(text)
+    if kind == "user" or not normalized:
+        return [normalized] if normalized else []
+    words = normalized.split(" ")
+    return [" ".join(words[i:]) for i in range(min(len(words), AUTOCOMPLETE_MAX_WORDS))]
+
+class PrefixIndex:
+    def __init__(self):
+        # Sorted keys split into blocks of about AUTOCOMPLETE_BLOCK_SIZE so an
+        # insert or delete shifts one block, not the whole array. Each key
+        # block has a parallel ref block: key_blocks[b][i] is indexed for
+        # ref_blocks[b][i] = (kind, id). firsts[b] is key_blocks[b][0].
+        self.key_blocks: List[List[str]] = []
+        self.ref_blocks: List[List[Tuple[str, str]]] = []
+        self.firsts: List[str] = []
+        self.labels: Dict[Tuple[str, str], str] = {}
+        self.key_count = 0
+        self.key_bytes = 0
+        self.built_at: Optional[datetime] = None
+        # add/remove calls recorded while a rebuild is running, else None
+        self.pending: Optional[List[Tuple[str, Tuple[Any, ...]]]] = None
+
+    def load(self, entries: List[Tuple[str, str, str]]):
+        """Rebuild from (kind, id, text) triples"""
+        labels, keys, refs = {}, [], []
+        for kind, entity_id, text in entries:
+            ref = (kind, entity_id)
+            labels[ref] = text
+            for key in autocomplete_keys(kind, text):
+                keys.append(key)
+                refs.append(ref)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        keys = [keys[i] for i in order]
+        refs = [refs[i] for i in order]
+        size = AUTOCOMPLETE_BLOCK_SIZE
+        self.key_blocks = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self.ref_blocks = [refs[i:i + size] for i in range(0, len(refs), size)]
+        self.firsts = [block[0] for block in self.key_blocks]
+        self.labels = labels
+        self.key_count = len(keys)
+        self.key_bytes = sum(sys.getsizeof(key) for key in keys)
+        self.built_at = datetime.now(timezone.utc)
+
+    def begin_rebuild(self):
+        """Record add/remove calls from now on, to be replayed by finish_rebuild"""
+        self.pending = []
+
+    def finish_rebuild(self, index: Optional["PrefixIndex"]):
+        """Take over a freshly loaded index and replay the changes made while
+        it was built (its source reads may predate them); None just stops recording"""
+        pending, self.pending = self.pending or [], None
+        if index is None:
+            return
+        self.__dict__.update(index.__dict__)
+        for method, args in pending:
+            getattr(self, method)(*args)
+
+    def add(self, kind: str, entity_id: str, text: str):
+        if self.pending is not None:
+            self.pending.append(("add", (kind, entity_id, text)))
+        ref = (kind, entity_id)
+        if self.labels.get(ref) == text:
+            return
+        self._unindex(ref)
+        self.labels[ref] = text
+        for key in autocomplete_keys(kind, text):
+            self._insert(key, ref)
+
+    def remove(self, kind: str, entity_id: str):
+        if self.pending is not None:
+            self.pending.append(("remove", (kind, entity_id)))
+        self._unindex((kind, entity_id))
+
+    def _insert(self, key: str, ref: Tuple[str, str]):
+        if not self.key_blocks:
+            self.key_blocks, self.ref_blocks, self.firsts = [[key]], [[ref]], [key]
+        else:
+            b = max(bisect.bisect_right(self.firsts, key) - 1, 0)
+            keys, refs = self.key_blocks[b], self.ref_blocks[b]
+            i = bisect.bisect_right(keys, key)
+            keys.insert(i, key)
+            refs.insert(i, ref)
+            if i == 0:
+                self.firsts[b] = key
+            if len(keys) > 2 * AUTOCOMPLETE_BLOCK_SIZE:
+                half = len(keys) // 2
+                self.key_blocks[b:b + 1] = [keys[:half], keys[half:]]
+                self.ref_blocks[b:b + 1] = [refs[:half], refs[half:]]
+                self.firsts[b:b + 1] = [keys[0], keys[half]]
+        self.key_count += 1
+        self.key_bytes += sys.getsizeof(key)
+
+    def _unindex(self, ref: Tuple[str, str]):
+        text = self.labels.pop(ref, None)
+        if text is None:
+            return
+        for key in autocomplete_keys(ref[0], text):
+            # Equal keys can run on from the end of the previous block
+            b = max(bisect.bisect_left(self.firsts, key) - 1, 0)
+            while b < len(self.key_blocks) and self.firsts[b] <= key:
+                keys, refs = self.key_blocks[b], self.ref_blocks[b]
+                i = bisect.bisect_left(keys, key)
+                while i < len(keys) and keys[i] == key and refs[i] != ref:
+                    i += 1
+                if i < len(keys) and keys[i] == key:
+                    del keys[i], refs[i]
+                    if not keys:
+                        del self.key_blocks[b], self.ref_blocks[b], self.firsts[b]
+                    elif i == 0:
+                        self.firsts[b] = keys[0]
+                    self.key_count -= 1
+                    self.key_bytes -= sys.getsizeof(key)
+                    break
+                b += 1
+
+    def search(self, query: str, limit: int) -> List[Dict[str, str]]:
+        prefix = normalize_autocomplete(query)
+        if not prefix:
+            return []
+        results, seen = [], set()
+        b = max(bisect.bisect_left(self.firsts, prefix) - 1, 0)
+        i = bisect.bisect_left(self.key_blocks[b], prefix) if self.key_blocks else 0
+        while b < len(self.key_blocks) and len(results) < limit:
+            keys, refs = self.key_blocks[b], self.ref_blocks[b]
+            while i < len(keys) and len(results) < limit and keys[i].startswith(prefix):
+                ref = refs[i]
+                if ref not in seen:
+                    seen.add(ref)
+                    results.append({"type": ref[0], "id": ref[1], "text": self.labels[ref]})
+                i += 1
+            if i < len(keys):
+                break
+            b, i = b + 1, 0
+        return results
+
+    def metrics(self) -> Dict[str, Any]:
+        # Shallow sizes: the block lists, the label dict and every key string
+        # (refs and labels share the tuples and title strings)
+        memory = (
+            sum(sys.getsizeof(keys) + sys.getsizeof(refs) for keys, refs in zip(self.key_blocks, self.ref_blocks))
+            + sys.getsizeof(self.key_blocks) + sys.getsizeof(self.ref_blocks) + sys.getsizeof(self.firsts)
+            + sys.getsizeof(self.labels) + self.key_bytes
+        )
+        return {
+            "entries": len(self.labels),
+            "keys": self.key_count,
+            "blocks": len(self.key_blocks),
+            "memory_bytes": memory,
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+        }
+
+autocomplete_index = PrefixIndex()
+register_metrics("autocomplete", autocomplete_index.metrics)
+
+@event_bus.subscribe("item.changed")
+async def autocomplete_on_item_changed(event: Dict[str, Any]):
+    item = event["document"]
+    if item and item.get("is_available", True):
+        autocomplete_index.add("item", item["id"], item["title"])
+    elif event["id"]:
+        autocomplete_index.remove("item", event["id"])
+
+@event_bus.subscribe("user.changed")
+async def autocomplete_on_user_changed(event: Dict[str, Any]):
+    user = event["document"]
+    if user and not user.get("is_banned", False):
+        autocomplete_index.add("user", user["id"], user["username"])
+    elif event["id"]:
+        autocomplete_index.remove("user", event["id"])
 
-@api_router.post("/auth/login")
-async def login(user_data: UserLogin):
-    # Find user
-    user = await db.users.find_one({"$or": [{"email": user_data.email_or_username}, {"username": user_data.email_or_username}]})
-    if not user or not verify_password(user_data.password, user["password"]):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+@periodic_job(AUTOCOMPLETE_REBUILD_SECONDS)
+async def rebuild_autocomplete_index():
+    """Reload the autocomplete index from available items and active users"""
+    # Events from here on may or may not be reflected in the reads below,
+    # so they are recorded and replayed onto the new index
+    autocomplete_index.begin_rebuild()
+    index = None
+    try:
+        entries = []
+        async for item in read_db.items.find({"is_available": True}, {"_id": 0, "id": 1, "title": 1}):
+            entries.append(("item", item["id"], item["title"]))
+        async for user in read_db.users.find({"is_banned": {"$ne": True}}, {"_id": 0, "id": 1, "username": 1}):
+            entries.append(("user", user["id"], user["username"]))
+        # Sorting a large catalog takes a while; build off the event loop and swap
+        index = PrefixIndex()
+        await asyncio.to_thread(index.load, entries)
+    finally:
+        autocomplete_index.finish_rebuild(index if index and index.built_at else None)
+
+# Leaderboards and trending
+# Trending items rank by an exponentially decayed borrow count kept per item
+# in `item_trends` and bumped on borrow requests and deliveries. A periodic
+# job turns the counters and user ratings into capped top-N lists (overall,
+# per category and per location) stored in `leaderboards`, which the
+# endpoints serve with a single document read. A lender's categories are
+# those of their available items.
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "300"))
+LEADERBOARD_SIZE = 20
+LEADERBOARD_MAX_LOCATIONS = 50  # Busiest owner locations get their own boards
+TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "72"))
+TRENDING_MIN_SCORE = 0.05  # Decayed below this an item's counter is dropped
+TRENDING_WEIGHTS = {"request": 1.0, "delivery": 2.0}
+
+async def record_item_trend(item_id: str, signal: str):
+    """Decay the item's trend score to now and add the signal's weight"""
+    now = datetime.now(timezone.utc)
+    decay = {"$pow": [0.5, {"$divide": [
+        {"$subtract": [now, {"$ifNull": ["$score_at", now]}]},
+        TRENDING_HALF_LIFE_HOURS * 3600 * 1000
+    ]}]}
+    await db.item_trends.update_one(
+        {"item_id": item_id},
+        [{"$set": {
+            "score": {"$add": [{"$multiply": [{"$ifNull": ["$score", 0]}, decay]}, TRENDING_WEIGHTS[signal]]},
+            "score_at": now
+        }}],
+        upsert=True
+    )
+
+def leaderboard_key(board: str, scope: Optional[str] = None, value: Optional[str] = None) -> str:
+    return f"{board}:{scope}:{value}" if scope else board
+
+@periodic_job(LEADERBOARD_REFRESH_SECONDS)
+async def refresh_leaderboards():
+    """Rebuild the top-N trending item and lender lists"""
+    now = datetime.now(timezone.utc)
+    boards: Dict[str, List[Dict[str, Any]]] = {}
     
-    if user.get("is_banned", False):
-        raise HTTPException(status_code=403, detail="Account is banned")
+    trends = await db.item_trends.find({}, {"_id": 0, "item_id": 1, "score": 1, "score_at": 1}).to_list(None)
+    if trends:
+        ages = np.array([(now - trend["score_at"].replace(tzinfo=timezone.utc)).total_seconds() for trend in trends])
+        scores = np.array([trend["score"] for trend in trends]) * np.exp2(-ages / (TRENDING_HALF_LIFE_HOURS * 3600))
+        # Only if unchanged since the read: a borrow bumped in between revives it
+        faded = [
+            DeleteOne({"item_id": trend["item_id"], "score": trend["score"], "score_at": trend["score_at"]})
+            for trend, score in zip(trends, scores) if score < TRENDING_MIN_SCORE
+        ]
+        if faded:
+            await db.item_trends.bulk_write(faded, ordered=False)
+        ranked = {trends[i]["item_id"]: float(scores[i]) for i in np.argsort(-scores) if scores[i] >= TRENDING_MIN_SCORE}
+        items = {
+            item["id"]: item
+            for item in await read_db.items.find(
+                {"id": {"$in": list(ranked)}, "is_available": True}, ITEM_SUMMARY_PROJECTION
+            ).to_list(None)
+        }
+        for item_id, score in ranked.items():
+            item = items.get(item_id)
+            if not item:
+                continue
+            entry = {**msgspec.to_builtins(item_summary(item)), "score": round(score, 3)}
+            for key in (
+                leaderboard_key("trending"),
+                leaderboard_key("trending", "category", item["category"]),
+                leaderboard_key("trending", "location", item.get("owner_location") or UNKNOWN_LOCATION),
+            ):
+                board = boards.setdefault(key, [])
+                if len(board) < LEADERBOARD_SIZE:
+                    board.append(entry)
     
-    # Create access token
-    access_token = create_access_token(data={"sub": user["id"]})
+    # Lenders: the index on (stars, success_rate) serves the overall board;
+    # per location boards cover the locations with the most listings
+    lender_query = {"is_banned": {"$ne": True}, "stars": {"$gt": 0}}
+    lender_projection = {"_id": 0, "id": 1, "username": 1, "location": 1, "stars": 1, "success_rate": 1, "profile_image": 1}
+    lender_sort = [("stars", -1), ("success_rate", -1)]
+    locations = await read_db.catalog_facets.find(
+        {"facet": "location", "count": {"$gt": 0}, "value": {"$ne": UNKNOWN_LOCATION}}, {"value": 1}
+    ).sort("count", -1).limit(LEADERBOARD_MAX_LOCATIONS).to_list(None)
+    scopes = [(leaderboard_key("lenders"), lender_query)] + [
+        (leaderboard_key("lenders", "location", location["value"]), {**lender_query, "location": location["value"]})
+        for location in locations
+    ]
+    results = await asyncio.gather(*[
+        read_db.users.find(query, lender_projection).sort(lender_sort).limit(LEADERBOARD_SIZE).to_list(None)
+        for _, query in scopes
+    ])
+    for (key, _), lenders in zip(scopes, results):
+        if lenders:
+            boards[key] = lenders
+    # Per category: each lender once per category they have available items in
+    category_lenders = await read_db.items.aggregate([
+        {"$match": {"is_available": True}},
+        {"$group": {"_id": {"category": "$category", "owner_id": "$owner_id"}}},
+        {"$lookup": {
+            "from": "users",
+            "localField": "_id.owner_id",
+            "foreignField": "id",
+            "pipeline": [{"$match": lender_query}, {"$project": lender_projection}],
+            "as": "lender"
+        }},
+        {"$unwind": "$lender"},
+        {"$sort": {"lender.stars": -1, "lender.success_rate": -1}},
+        {"$group": {"_id": "$_id.category", "lenders": {"$push": "$lender"}}},
+        {"$project": {"lenders": {"$slice": ["$lenders", LEADERBOARD_SIZE]}}}
+    ], allowDiskUse=True).to_list(None)
+    for category in category_lenders:
+        boards[leaderboard_key("lenders", "category", category["_id"])] = category["lenders"]
     
-    return {"access_token": access_token, "token_type": "bearer", "user": UserProfile(**user)}
+    if boards:
+        await db.leaderboards.bulk_write(
+            [ReplaceOne({"_id": key}, {"entries": entries, "built_at": now}, upsert=True) for key, entries in boards.items()],
+            ordered=False
+        )
+    await db.leaderboards.delete_many({"_id": {"$nin": list(boards)}})
 
-@api_router.get("/auth/me", response_model=UserProfile)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return UserProfile(**current_user.dict())
+async def get_leaderboard(key: str) -> List[Dict[str, Any]]:
+    board = await read_db.leaderboards.find_one({"_id": key})
+    return board["entries"] if board else []
 
-# File Upload Route (IMPROVED)
-@api_router.post("/upload-images")
-async def upload_images(
-    files: list[UploadFile] = File(...),
-    current_user: User = Depends(get_current_user)  # IMPROVED: Use correct type
-):
-    if len(files) < 1 or len(files) > 5:
-        raise HTTPException(status_code=400, detail="You must upload between 1 and 5 images")
-    
-    uploaded_files = []
-    for file in files:
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Only image files are allowed")
-        
-        # Upload directly to Cloudinary under user-specific folder (IMPROVED)
-        result = cloudinary.uploader.upload(
-            file.file, 
-            folder=f"users/{current_user.id}/uploads/"
-        )
-        file_url = result["secure_url"]  # Public URL
-        uploaded_files.append(file_url)
-    
-    return {"uploaded_files": uploaded_files}
+# Item validation and bulk import
+BULK_IMPORT_CHUNK_SIZE = 1000
+BULK_IMPORT_MAX_ROWS = int(os.getenv("BULK_IMPORT_MAX_ROWS", "50000"))
+BULK_IMPORT_MAX_ERRORS = 1000
+
+def item_validation_error(value: int, category: str, images: List[str]) -> Optional[str]:
+    """The first item rule broken, shared by create_item and bulk import"""
+    if value > 100000:
+        return "Item value cannot exceed ₹1,00,000"
+    if category not in CATEGORIES:
+        return "Invalid category"
+    if len(images) < 1 or len(images) > 5:
+        return "Item must have between 1 and 5 images"
+    return None
+
+def bulk_import_item(row, file_format: str, owner: User) -> Dict[str, Any]:
+    """Validate one CSV row dict or NDJSON line into an item document"""
+    if file_format == "ndjson":
+        row = json.loads(row)
+        if not isinstance(row, dict):
+            raise ValueError("Row must be a JSON object")
+        images = row.get("images") or []
+    else:
+        images = [url.strip() for url in (row.get("images") or "").split("|") if url.strip()]
+    if not isinstance(images, list):
+        raise ValueError("images must be a list")
+    fields = ItemCreate(**{key: row.get(key) for key in ItemCreate.__fields__})
+    error = item_validation_error(fields.value, fields.category, images)
+    if error:
+        raise ValueError(error)
+    item = Item(
+        **fields.dict(exclude={"availability_start", "availability_end"}),
+        owner_id=owner.id,
+        owner_location=owner.location,
+        images=images,
+        availability_start=datetime.fromisoformat(fields.availability_start),
+        availability_end=datetime.fromisoformat(fields.availability_end)
+    )
+    return item.dict()
+
+def read_import_chunk(rows, row_number: int, file_format: str, owner: User):
+    """Read and validate up to BULK_IMPORT_CHUNK_SIZE rows after `row_number`.
+
+    Runs in a worker thread: decoding and validation are CPU bound. Returns
+    (valid (row number, item) pairs, (row number, error) failures, last row
+    number read, why reading stopped: None, "end", "row_limit" or "unreadable").
+    """
+    chunk, failures = [], []
+    while len(chunk) + len(failures) < BULK_IMPORT_CHUNK_SIZE:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return chunk, failures, row_number, "end"
+        except (UnicodeDecodeError, csv.Error) as e:
+            failures.append((row_number + 1, f"Unreadable input, import stopped here: {e}"))
+            return chunk, failures, row_number, "unreadable"
+        if row_number + 1 > BULK_IMPORT_MAX_ROWS:
+            return chunk, failures, row_number, "row_limit"
+        row_number += 1
+        try:
+            chunk.append((row_number, bulk_import_item(row, file_format, owner)))
+        except (ValueError, TypeError, KeyError, ValidationError) as e:
+            failures.append((row_number, str(e)))
+    return chunk, failures, row_number, None
 
+async def insert_item_chunk(chunk: List[Tuple[int, Dict[str, Any]]], report: Dict[str, Any], fail):
+    """Insert validated (row number, item) pairs with one unordered insert_many"""
+    images = list({url for _, item in chunk for url in item["images"]})
+    thumbnails = dict(zip(images, await get_thumbnails(images)))
+    for _, item in chunk:
+        item["thumbnails"] = [thumbnails[url] for url in item["images"]]
+    failed_rows = set()
+    try:
+        await db.items.insert_many([item for _, item in chunk], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            row_number = chunk[write_error["index"]][0]
+            failed_rows.add(row_number)
+            fail(row_number, write_error.get("errmsg", "Insert failed"))
+    inserted = [item for row_number, item in chunk if row_number not in failed_rows]
+    report["inserted"] += len(inserted)
+    await adjust_catalog_facets_many(inserted, 1)
 
 # Item Routes
 @api_router.post("/items", response_model=Item)
@@ -404,14 +2936,9 @@ async def create_item(
     images: List[str] = Form(...),
     current_user: User = Depends(get_current_user)
 ):
-    if value > 100000:
-        raise HTTPException(status_code=400, detail="Item value cannot exceed ₹1,00,000")
-    
-    if category not in CATEGORIES:
-        raise HTTPException(status_code=400, detail="Invalid category")
-    
-    if len(images) < 1 or len(images) > 5:
-        raise HTTPException(status_code=400, detail="Item must have between 1 and 5 images")
+    error = item_validation_error(value, category, images)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
     
     item = Item(
         title=title,
@@ -420,20 +2947,69 @@ async def create_item(
         value=value,
         token_per_day=token_per_day,
         owner_id=current_user.id,
+        owner_location=current_user.location,
         images=images,
+        thumbnails=await get_thumbnails(images),
         availability_start=datetime.fromisoformat(availability_start),
         availability_end=datetime.fromisoformat(availability_end)
     )
     
     await db.items.insert_one(item.dict())
+    await adjust_catalog_facets(item.dict(), 1)
     return item
 
-@api_router.get("/items", response_model=List[Item])
-async def get_items(
-    category: Optional[str] = None,
-    location: Optional[str] = None,
-    search: Optional[str] = None
+@api_router.post("/items/bulk", dependencies=[Depends(rate_limit("bulk_import"))])
+async def bulk_import_items(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user)
 ):
+    """Create items from a CSV or NDJSON upload.
+
+    Rows use the create_item fields; `images` is a list in NDJSON and
+    "|"-separated in CSV. Rows are validated and inserted in chunks, so
+    memory stays flat, and failures are reported per row (1-based). Rows
+    past BULK_IMPORT_MAX_ROWS or an undecodable line end the import early
+    with `truncated` set; everything before it is kept and reported.
+    """
+    file_format = format or ("ndjson" if file.filename and file.filename.lower().endswith((".ndjson", ".jsonl")) else "csv")
+    if file_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    
+    text = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    rows = csv.DictReader(text) if file_format == "csv" else (line for line in text if line.strip())
+    report = {"inserted": 0, "failed": 0, "errors": [], "errors_truncated": False, "truncated": False}
+    
+    def fail(row_number: int, error: str):
+        report["failed"] += 1
+        if len(report["errors"]) < BULK_IMPORT_MAX_ERRORS:
+            report["errors"].append({"row": row_number, "error": error})
+        else:
+            report["errors_truncated"] = True
+    
+    row_number, stopped = 0, None
+    while stopped is None:
+        chunk, failures, row_number, stopped = await asyncio.to_thread(
+            read_import_chunk, rows, row_number, file_format, current_user
+        )
+        for failed_row, error in failures:
+            fail(failed_row, error)
+        if chunk:
+            await insert_item_chunk(chunk, report, fail)
+    
+    if stopped == "row_limit":
+        report["truncated"] = True
+        report["detail"] = f"Imports are limited to {BULK_IMPORT_MAX_ROWS} rows; later rows were not imported"
+    elif stopped == "unreadable":
+        report["truncated"] = True
+    return report
+
+async def find_catalog_items(
+    category: Optional[str],
+    location: Optional[str],
+    search: Optional[str],
+    projection: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
     query = {"is_available": True}
     
     if category:
@@ -445,29 +3021,211 @@ async def get_items(
             {"description": {"$regex": search, "$options": "i"}}
         ]
     
-    items = await db.items.find(query).to_list(None)
+    items = await read_db.items.find(query, projection).to_list(None)
     
     # Filter by location if provided
     if location:
         item_ids = [item["id"] for item in items]
-        users = await db.users.find({"id": {"$in": [item["owner_id"] for item in items]}}).to_list(None)
+        users = await read_db.users.find({"id": {"$in": [item["owner_id"] for item in items]}}).to_list(None)
         location_filtered_user_ids = [user["id"] for user in users if location.lower() in user["location"].lower()]
         items = [item for item in items if item["owner_id"] in location_filtered_user_ids]
+    return items
+
+@api_router.get("/items", response_model=List[Item], dependencies=[Depends(rate_limit("items"))])
+async def get_items(
+    category: Optional[str] = None,
+    location: Optional[str] = None,
+    search: Optional[str] = None,
+    view: str = "full"
+):
+    """Available items; `view=summary` returns lean ItemSummary rows"""
+    projection = ITEM_SUMMARY_PROJECTION if view == "summary" else None
+    items = await find_catalog_items(category, location, search, projection)
     
+    if view == "summary":
+        # Skips pydantic validation entirely: msgspec encodes the structs directly
+        return Response(
+            content=item_summaries_encoder.encode([item_summary(item) for item in items]),
+            media_type="application/json"
+        )
     return [Item(**item) for item in items]
 
+@api_router.get("/items/facets")
+async def get_item_facets(
+    category: Optional[str] = None,
+    location: Optional[str] = None,
+    search: Optional[str] = None
+):
+    """Available item counts per category, location and token price bucket
+    for the same filters as GET /items"""
+    if not (category or location or search):
+        counts = {"category": {}, "location": {}, "token_price": {}}
+        async for counter in read_db.catalog_facets.find({"count": {"$gt": 0}}):
+            counts[counter["facet"]][counter["value"]] = counter["count"]
+        return format_catalog_facets(counts)
+
+    query = {"is_available": True}
+    if category:
+        query["category"] = category
+    if location:
+        query["owner_location"] = {"$regex": re.escape(location), "$options": "i"}
+    if search:
+        query["$or"] = [
+            {"title": {"$regex": search, "$options": "i"}},
+            {"description": {"$regex": search, "$options": "i"}}
+        ]
+    result = await read_db.items.aggregate(catalog_facets_pipeline(query)).to_list(None)
+    counts = {
+        facet: {facet_bucket_label(facet, bucket["_id"]): bucket["count"] for bucket in buckets}
+        for facet, buckets in result[0].items()
+    }
+    return format_catalog_facets(counts)
+
+@api_router.get("/autocomplete")
+async def autocomplete(q: str, limit: int = 10):
+    """Item titles and usernames starting with `q` (or with a title word starting with it)"""
+    limit = max(1, min(limit, AUTOCOMPLETE_MAX_RESULTS))
+    return {"suggestions": autocomplete_index.search(q, limit)}
+
+@api_router.get("/items/trending")
+async def get_trending_items(category: Optional[str] = None, location: Optional[str] = None):
+    """Most borrowed available items lately, optionally within one category or owner location"""
+    if category:
+        key = leaderboard_key("trending", "category", category)
+    elif location:
+        key = leaderboard_key("trending", "location", location)
+    else:
+        key = leaderboard_key("trending")
+    return {"items": await get_leaderboard(key)}
+
+@api_router.get("/leaderboards/lenders")
+async def get_lender_leaderboard(category: Optional[str] = None, location: Optional[str] = None):
+    """Top-rated lenders by stars then success rate, optionally lending in one category or location"""
+    if category:
+        key = leaderboard_key("lenders", "category", category)
+    elif location:
+        key = leaderboard_key("lenders", "location", location)
+    else:
+        key = leaderboard_key("lenders")
+    return {"lenders": await get_leaderboard(key)}
+
 @api_router.get("/items/{item_id}", response_model=Item)
 async def get_item(item_id: str):
-    item = await db.items.find_one({"id": item_id})
+    # Primary: an owner opening the item they just edited must see the edit
+    item = await item_reads.do(item_id, lambda: db.items.find_one({"id": item_id}))
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
     return Item(**item)
 
+@api_router.get("/items/{item_id}/similar", response_model=List[Item])
+async def get_similar_items(item_id: str, limit: int = 10):
+    doc = await read_db.item_neighbors.find_one({"item_id": item_id})
+    if not doc:
+        return []
+    return await fetch_available_items([neighbor["item_id"] for neighbor in doc["neighbors"]], limit)
+
+@api_router.get("/recommendations", response_model=List[Item])
+async def get_recommendations(limit: int = 20, current_user: TokenUser = Depends(get_token_user)):
+    """Items similar to everything the user has borrowed, newest listings as fallback"""
+    borrowed = {"borrower_id": current_user.id, "status": TransactionStatus.COMPLETED}
+    history = list(
+        set(await read_db.transactions.distinct("item_id", borrowed))
+        | set(await read_db.transactions_archive.distinct("item_id", borrowed))
+    )
+    scores = {}
+    async for doc in read_db.item_neighbors.find({"item_id": {"$in": history}}):
+        for neighbor in doc["neighbors"]:
+            scores[neighbor["item_id"]] = scores.get(neighbor["item_id"], 0.0) + neighbor["score"]
+    for item_id in history:
+        scores.pop(item_id, None)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    items = await fetch_available_items(ranked, limit, exclude_owner=current_user.id)
+    if items:
+        return items
+    newest = await read_db.items.find(
+        {"is_available": True, "owner_id": {"$ne": current_user.id}}
+    ).sort("created_at", -1).limit(limit).to_list(None)
+    return [Item(**item) for item in newest]
+
 @api_router.get("/my-items", response_model=List[Item])
-async def get_my_items(current_user: User = Depends(get_current_user)):
+async def get_my_items(current_user: TokenUser = Depends(get_token_user)):
     items = await db.items.find({"owner_id": current_user.id}).to_list(None)
     return [Item(**item) for item in items]
 
+# User activity read model
+# One `user_activities` document per (user, transaction) holding the
+# transaction plus a copy of the item and the counterpart username, rewritten
+# on every transaction state change so /my-activities is a single indexed read.
+# Item edits, availability and owner location changes are copied over as well.
+ACTIVITY_BACKFILL_SECONDS = float(os.getenv("ACTIVITY_BACKFILL_SECONDS", "3600"))
+# Transactions created this long before the previous backfill are checked again
+ACTIVITY_BACKFILL_OVERLAP = timedelta(minutes=10)
+ACTIVITY_BACKFILL_BATCH_SIZE = 500
+
+def activity_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in item.items() if key != "_id"}
+
+async def refresh_user_activity(transaction_id: str):
+    """Rewrite both participants' activity entries for a transaction"""
+    transaction = await db.transactions.find_one({"id": transaction_id}, {"_id": 0})
+    if not transaction:
+        return
+    item = await db.items.find_one({"id": transaction["item_id"]}, {"_id": 0})
+    participants = [transaction["borrower_id"], transaction["owner_id"]]
+    users = {
+        user["id"]: user["username"]
+        for user in await db.users.find({"id": {"$in": participants}}, {"id": 1, "username": 1}).to_list(None)
+    }
+    now = datetime.now(timezone.utc)
+    operations = []
+    for role, user_id, counterpart_id in (
+        ("borrower", transaction["borrower_id"], transaction["owner_id"]),
+        ("owner", transaction["owner_id"], transaction["borrower_id"]),
+    ):
+        update = {
+            "role": role,
+            "status": transaction["status"],
+            "transaction": transaction,
+            "counterpart": {"id": counterpart_id, "username": users.get(counterpart_id)},
+            "created_at": transaction["created_at"],
+            "updated_at": now
+        }
+        # A deleted item keeps the copy captured while it existed
+        if item:
+            update["item"] = activity_item(item)
+        operations.append(UpdateOne(
+            {"user_id": user_id, "transaction_id": transaction_id},
+            {"$set": update},
+            upsert=True
+        ))
+    await db.user_activities.bulk_write(operations, ordered=False)
+
+async def refresh_missing_activities(transaction_ids: List[str]):
+    existing = set(await db.user_activities.distinct("transaction_id", {"transaction_id": {"$in": transaction_ids}}))
+    for transaction_id in transaction_ids:
+        if transaction_id not in existing:
+            await refresh_user_activity(transaction_id)
+
+@periodic_job(ACTIVITY_BACKFILL_SECONDS)
+async def backfill_user_activities():
+    """Build activity entries for transactions that have none: every
+    transaction on the first run (created before the read model existed),
+    then only those created since the previous run (e.g. a failed refresh)"""
+    started = datetime.now(timezone.utc)
+    state = await db.activity_state.find_one({"_id": "backfill"})
+    query = {}
+    if state:
+        query["created_at"] = {"$gte": state["checked_until"].replace(tzinfo=timezone.utc) - ACTIVITY_BACKFILL_OVERLAP}
+    batch = []
+    async for transaction in db.transactions.find(query, {"_id": 0, "id": 1}):
+        batch.append(transaction["id"])
+        if len(batch) == ACTIVITY_BACKFILL_BATCH_SIZE:
+            await refresh_missing_activities(batch)
+            batch = []
+    if batch:
+        await refresh_missing_activities(batch)
+    await db.activity_state.update_one({"_id": "backfill"}, {"$set": {"checked_until": started}}, upsert=True)
+
 # Transaction Routes
 @api_router.post("/transactions/request")
 async def request_item(
@@ -500,6 +3258,7 @@ async def request_item(
     )
     
     await db.transactions.insert_one(transaction.dict())
+    await record_item_trend(item["id"], "request")
     
     # Create notification for owner
     await create_notification(
@@ -510,10 +3269,12 @@ async def request_item(
         transaction.id
     )
     
+    await refresh_user_activity(transaction.id)
+    
     return {"message": "Request sent successfully", "transaction_id": transaction.id}
 
 @api_router.get("/transactions/pending", response_model=List[Dict])
-async def get_pending_requests(current_user: User = Depends(get_current_user)):
+async def get_pending_requests(current_user: TokenUser = Depends(get_token_user)):
     transactions = await db.transactions.find({
         "owner_id": current_user.id,
         "status": TransactionStatus.PENDING
@@ -534,7 +3295,7 @@ async def get_pending_requests(current_user: User = Depends(get_current_user)):
 @api_router.post("/transactions/{transaction_id}/approve")
 async def approve_request(
     transaction_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     transaction = await db.transactions.find_one({"id": transaction_id, "owner_id": current_user.id})
     if not transaction:
@@ -543,7 +3304,7 @@ async def approve_request(
     # Update transaction status
     await db.transactions.update_one(
         {"id": transaction_id},
-        {"$set": {"status": TransactionStatus.APPROVED}}
+        {"$set": {"status": TransactionStatus.APPROVED, "updated_at": datetime.now(timezone.utc)}}
     )
     
     # Create notifications
@@ -555,12 +3316,14 @@ async def approve_request(
         transaction_id
     )
     
+    await refresh_user_activity(transaction_id)
+    
     return {"message": "Request approved"}
 
 @api_router.post("/transactions/{transaction_id}/reject")
 async def reject_request(
     transaction_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     transaction = await db.transactions.find_one({"id": transaction_id, "owner_id": current_user.id})
     if not transaction:
@@ -569,7 +3332,7 @@ async def reject_request(
     # Update transaction status
     await db.transactions.update_one(
         {"id": transaction_id},
-        {"$set": {"status": TransactionStatus.REJECTED}}
+        {"$set": {"status": TransactionStatus.REJECTED, "updated_at": datetime.now(timezone.utc)}}
     )
     
     # Create notification
@@ -581,50 +3344,76 @@ async def reject_request(
         transaction_id
     )
     
+    await refresh_user_activity(transaction_id)
+    
     return {"message": "Request rejected"}
 
+def activity_entry(activity: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "transaction": Transaction(**activity["transaction"]),
+        "item": Item(**activity["item"]) if activity.get("item") else None,
+        "counterpart": activity.get("counterpart")
+    }
+
 @api_router.get("/my-activities")
-async def get_my_activities(current_user: User = Depends(get_current_user)):
-    # Get transactions as borrower
-    borrower_transactions = await db.transactions.find({"borrower_id": current_user.id}).to_list(None)
-    
-    # Get transactions as owner
-    owner_transactions = await db.transactions.find({"owner_id": current_user.id}).to_list(None)
-    
-    # Get items for transactions
-    all_item_ids = set()
-    for t in borrower_transactions + owner_transactions:
-        all_item_ids.add(t["item_id"])
-    
-    items = await db.items.find({"id": {"$in": list(all_item_ids)}}).to_list(None)
-    items_dict = {item["id"]: item for item in items}
+async def get_my_activities(
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    include_archived: bool = False,
+    current_user: TokenUser = Depends(get_token_user)
+):
+    """Transactions the user took part in, newest first, from the activity view.
+
+    `status` takes one or more comma-separated TransactionStatus values.
+    Without `limit` every matching entry is returned; with it (at most 500)
+    the response has a `next_cursor` to pass as `before` for the next page.
+    Archived history is only included with `include_archived=true`.
+    """
+    query = {"user_id": current_user.id}
+    if status:
+        query["status"] = {"$in": status.split(",")}
+    if before:
+        try:
+            query["created_at"] = {"$lt": datetime.fromisoformat(before)}
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if limit is not None:
+        limit = max(1, min(limit, 500))
+    activities = await find_with_archive(
+        "user_activities",
+        query,
+        ("created_at", -1),
+        include_archived=include_archived,
+        limit=limit or 0,
+        projection={"_id": 0, "role": 1, "transaction": 1, "item": 1, "counterpart": 1, "created_at": 1}
+    )
     
     result = {
         "as_borrower": [],
-        "as_owner": []
+        "as_owner": [],
+        "next_cursor": activities[-1]["created_at"].isoformat() if limit and len(activities) == limit else None
     }
-    
-    for t in borrower_transactions:
-        item = items_dict.get(t["item_id"])
-        result["as_borrower"].append({
-            "transaction": Transaction(**t),
-            "item": Item(**item) if item else None
-        })
-    
-    for t in owner_transactions:
-        item = items_dict.get(t["item_id"])
-        result["as_owner"].append({
-            "transaction": Transaction(**t),
-            "item": Item(**item) if item else None
-        })
+    for activity in activities:
+        result["as_borrower" if activity["role"] == "borrower" else "as_owner"].append(activity_entry(activity))
     
     return result
 
+@api_router.get("/my-activities/{transaction_id}")
+async def get_my_activity(transaction_id: str, current_user: TokenUser = Depends(get_token_user)):
+    """One transaction the user took part in, archived or not, with their role"""
+    activity = await find_one_with_archive(
+        "user_activities", {"user_id": current_user.id, "transaction_id": transaction_id}
+    )
+    if not activity:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return {"role": activity["role"], **activity_entry(activity)}
+
 # Delivery confirmation with improved token management
 @api_router.post("/transactions/{transaction_id}/confirm-delivery")
 async def confirm_delivery(
     transaction_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     transaction = await db.transactions.find_one({"id": transaction_id})
     if not transaction:
@@ -638,7 +3427,7 @@ async def confirm_delivery(
     else:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.transactions.update_one({"id": transaction_id}, {"$set": update_data})
+    await db.transactions.update_one({"id": transaction_id}, {"$set": {**update_data, "updated_at": datetime.now(timezone.utc)}})
     
     # Check if both confirmed
     updated_transaction = await db.transactions.find_one({"id": transaction_id})
@@ -659,9 +3448,15 @@ async def confirm_delivery(
             )
             
             # Update transaction status
+            now = datetime.now(timezone.utc)
             await db.transactions.update_one(
                 {"id": transaction_id},
-                {"$set": {"status": TransactionStatus.DELIVERED}}
+                {"$set": {
+                    "status": TransactionStatus.DELIVERED,
+                    "delivered_at": now,
+                    "tokens_paid": transaction["total_tokens"],
+                    "updated_at": now
+                }}
             )
             
             # Notify both users
@@ -703,9 +3498,15 @@ async def confirm_delivery(
             )
             
             # Update transaction status
+            now = datetime.now(timezone.utc)
             await db.transactions.update_one(
                 {"id": transaction_id},
-                {"$set": {"status": TransactionStatus.DELIVERED}}
+                {"$set": {
+                    "status": TransactionStatus.DELIVERED,
+                    "delivered_at": now,
+                    "tokens_paid": borrower["tokens"],
+                    "updated_at": now
+                }}
             )
             
             # Notify users about insufficient tokens
@@ -723,6 +3524,10 @@ async def confirm_delivery(
                 "partial_payment",
                 transaction_id
             )
+        
+        await record_item_trend(transaction["item_id"], "delivery")
+    
+    await refresh_user_activity(transaction_id)
     
     return {"message": "Delivery confirmation recorded"}
 
@@ -731,7 +3536,7 @@ async def confirm_delivery(
 async def confirm_return(
     transaction_id: str,
     damage_severity: str = "none",
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     transaction = await db.transactions.find_one({"id": transaction_id})
     if not transaction:
@@ -745,7 +3550,7 @@ async def confirm_return(
     else:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.transactions.update_one({"id": transaction_id}, {"$set": update_data})
+    await db.transactions.update_one({"id": transaction_id}, {"$set": {**update_data, "updated_at": datetime.now(timezone.utc)}})
     
     # Check if both confirmed
     updated_transaction = await db.transactions.find_one({"id": transaction_id})
@@ -824,31 +3629,41 @@ async def confirm_return(
         # Update transaction status to completed (ready for feedback)
         await db.transactions.update_one(
             {"id": transaction_id},
-            {"$set": {"status": TransactionStatus.COMPLETED}}
+            {"$set": {"status": TransactionStatus.COMPLETED, "updated_at": datetime.now(timezone.utc)}}
         )
-        
-        # Update user stats
-        await update_user_stats(transaction["borrower_id"])
-        await update_user_stats(transaction["owner_id"])
+        await enqueue_co_borrow(transaction)
+        await refresh_user_activity(transaction_id)
         
         return {"message": "Return confirmation recorded", "feedback_required": True, "transaction_completed": True}
     
+    await refresh_user_activity(transaction_id)
+    
     return {"message": "Return confirmation recorded", "feedback_required": False}
 
 # Reviews
 @api_router.post("/reviews")
 async def create_review(
     review_data: ReviewCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     # Check if transaction exists and user is part of it
-    transaction = await db.transactions.find_one({"id": review_data.transaction_id})
+    transaction = await find_one_with_archive("transactions", {"id": review_data.transaction_id})
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
     if current_user.id not in [transaction["borrower_id"], transaction["owner_id"]]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    if transaction["status"] != TransactionStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Transaction is not completed yet")
+    
+    counterpart_id = transaction["owner_id"] if current_user.id == transaction["borrower_id"] else transaction["borrower_id"]
+    if review_data.reviewed_user_id != counterpart_id:
+        raise HTTPException(status_code=400, detail="You can only review the other party of the transaction")
+    
+    if await db.reviews.find_one({"transaction_id": review_data.transaction_id, "reviewer_id": current_user.id}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="You already reviewed this transaction")
+    
     # Create review
     review = Review(
         transaction_id=review_data.transaction_id,
@@ -858,24 +3673,38 @@ async def create_review(
         comment=review_data.comment
     )
     
+    # Stars are updated by score_reputation
     await db.reviews.insert_one(review.dict())
     
-    # Update user stats
-    await update_user_stats(review_data.reviewed_user_id)
-    
     return {"message": "Review created successfully"}
 
 @api_router.get("/reviews/{user_id}", response_model=List[Review])
 async def get_user_reviews(user_id: str):
-    reviews = await db.reviews.find({"reviewed_user_id": user_id}).to_list(None)
+    reviews = await review_reads.do(
+        user_id, lambda: read_db.reviews.find({"reviewed_user_id": user_id, "is_flagged": {"$ne": True}}).to_list(None)
+    )
     return [Review(**review) for review in reviews]
 
 # Complaints
 @api_router.post("/complaints")
 async def create_complaint(
     complaint_data: ComplaintCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
+    transaction = await find_one_with_archive("transactions", {"id": complaint_data.transaction_id})
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    
+    parties = [transaction["borrower_id"], transaction["owner_id"]]
+    if current_user.id not in parties:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    if complaint_data.complained_user_id not in parties or complaint_data.complained_user_id == current_user.id:
+        raise HTTPException(status_code=400, detail="You can only complain about the other party of the transaction")
+    
+    if await db.complaints.find_one({"transaction_id": complaint_data.transaction_id, "complainant_id": current_user.id}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="You already filed a complaint for this transaction")
+    
     complaint = Complaint(
         complainant_id=current_user.id,
         complained_user_id=complaint_data.complained_user_id,
@@ -884,41 +3713,22 @@ async def create_complaint(
         description=complaint_data.description
     )
     
+    # Validated, counted and applied to the user's stars by score_reputation
     await db.complaints.insert_one(complaint.dict())
     
-    # For demo purposes, mark complaint as valid and update user
-    await db.complaints.update_one({"id": complaint.id}, {"$set": {"is_valid": True}})
-    
-    # Update complained user
-    user = await db.users.find_one({"id": complaint_data.complained_user_id})
-    new_complaints_count = user["complaints_count"] + 1
-    
-    # Halve stars
-    new_stars = user["stars"] / 2
-    
-    await db.users.update_one(
-        {"id": complaint_data.complained_user_id},
-        {
-            "$set": {
-                "complaints_count": new_complaints_count,
-                "stars": new_stars,
-                "is_banned": new_complaints_count >= 20
-            }
-        }
-    )
-    
     return {"message": "Complaint filed successfully"}
 
 @api_router.get("/complaints/{user_id}", response_model=List[Complaint])
 async def get_user_complaints(user_id: str):
-    complaints = await db.complaints.find({"complained_user_id": user_id}).to_list(None)
+    # Complaints still waiting for score_reputation, or flagged by it, are not public
+    complaints = await read_db.complaints.find({"complained_user_id": user_id, "is_valid": True}).to_list(None)
     return [Complaint(**complaint) for complaint in complaints]
 
 # Messages/Chat
 @api_router.post("/messages")
 async def send_message(
     message_data: MessageCreate,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     message = Message(
         transaction_id=message_data.transaction_id,
@@ -929,11 +3739,14 @@ async def send_message(
     
     await db.messages.insert_one(message.dict())
     
+    # The token's username predates any rename since it was issued
+    sender = await db.users.find_one({"id": current_user.id}, {"_id": 0, "username": 1})
+    
     # Create notification
     await create_notification(
         message_data.receiver_id,
         "New Message",
-        f"New message from {current_user.username}",
+        f"New message from {sender['username'] if sender else current_user.username}",
         "message",
         message_data.transaction_id
     )
@@ -943,18 +3756,24 @@ async def send_message(
 @api_router.get("/messages/{transaction_id}")
 async def get_messages(
     transaction_id: str,
-    current_user: User = Depends(get_current_user)
+    include_archived: bool = False,
+    current_user: TokenUser = Depends(get_token_user)
 ):
     # Verify user is part of transaction
-    transaction = await db.transactions.find_one({"id": transaction_id})
+    if include_archived:
+        transaction = await find_one_with_archive("transactions", {"id": transaction_id})
+    else:
+        transaction = await db.transactions.find_one({"id": transaction_id})
     if not transaction or current_user.id not in [transaction["borrower_id"], transaction["owner_id"]]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    messages = await db.messages.find({"transaction_id": transaction_id}).sort("timestamp", 1).to_list(None)
+    messages = await find_with_archive(
+        "messages", {"transaction_id": transaction_id}, ("timestamp", 1), include_archived=include_archived
+    )
     return [Message(**message) for message in messages]
 
 @api_router.get("/chat-list")
-async def get_chat_list(current_user: User = Depends(get_current_user)):
+async def get_chat_list(current_user: TokenUser = Depends(get_token_user)):
     # Get all transactions where user is involved
     transactions = await db.transactions.find({
         "$or": [{"borrower_id": current_user.id}, {"owner_id": current_user.id}],
@@ -978,42 +3797,47 @@ async def get_chat_list(current_user: User = Depends(get_current_user)):
 
 # Notifications
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: User = Depends(get_current_user)):
-    notifications = await db.notifications.find({"user_id": current_user.id}).sort("created_at", -1).to_list(None)
+async def get_notifications(include_archived: bool = False, current_user: TokenUser = Depends(get_token_user)):
+    notifications = await find_with_archive(
+        "notifications", {"user_id": current_user.id}, ("created_at", -1), include_archived=include_archived
+    )
     return [Notification(**notification) for notification in notifications]
 
 @api_router.post("/notifications/{notification_id}/read")
 async def mark_notification_read(
     notification_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     await db.notifications.update_one(
         {"id": notification_id, "user_id": current_user.id},
-        {"$set": {"is_read": True}}
+        {"$set": {"is_read": True, "updated_at": datetime.now(timezone.utc)}}
     )
     return {"message": "Notification marked as read"}
 
 @api_router.delete("/notifications/{notification_id}")
 async def delete_notification(
     notification_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     result = await db.notifications.delete_one(
         {"id": notification_id, "user_id": current_user.id}
     )
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Notification not found")
+    await record_tombstones(current_user.id, "notifications", [notification_id])
     return {"message": "Notification deleted"}
 
 # Penalties
 @api_router.get("/penalties", response_model=List[Penalty])
-async def get_my_penalties(current_user: User = Depends(get_current_user)):
-    penalties = await db.penalties.find({"user_id": current_user.id}).to_list(None)
+async def get_my_penalties(include_archived: bool = False, current_user: TokenUser = Depends(get_token_user)):
+    penalties = await find_with_archive(
+        "penalties", {"user_id": current_user.id}, ("created_at", 1), include_archived=include_archived
+    )
     return [Penalty(**penalty) for penalty in penalties]
 
 # Process pending penalties when user receives tokens
 @api_router.post("/process-pending-penalties")
-async def process_pending_penalties(current_user: User = Depends(get_current_user)):
+async def process_pending_penalties(current_user: TokenUser = Depends(get_token_user)):
     # Get all unpaid penalties for user
     penalties = await db.penalties.find({"user_id": current_user.id, "is_paid": False}).to_list(None)
     
@@ -1026,6 +3850,13 @@ async def process_pending_penalties(current_user: User = Depends(get_current_use
     
     for penalty in penalties:
         if available_tokens >= penalty["amount"]:
+            # The creditor is the transaction's owner; it may have been archived
+            transaction = await find_one_with_archive("transactions", {"id": penalty["transaction_id"]})
+            if not transaction:
+                # Taking the tokens would credit nobody: leave it unpaid
+                logger.error(f"Penalty {penalty['id']} references missing transaction {penalty['transaction_id']}")
+                continue
+            
             # Pay this penalty
             available_tokens -= penalty["amount"]
             
@@ -1035,13 +3866,11 @@ async def process_pending_penalties(current_user: User = Depends(get_current_use
                 {"$set": {"is_paid": True}}
             )
             
-            # Get the creditor (owner) and credit tokens
-            transaction = await db.transactions.find_one({"id": penalty["transaction_id"]})
-            if transaction:
-                await db.users.update_one(
-                    {"id": transaction["owner_id"]},
-                    {"$inc": {"tokens": penalty["amount"]}}
-                )
+            # Credit the owner
+            await db.users.update_one(
+                {"id": transaction["owner_id"]},
+                {"$inc": {"tokens": penalty["amount"]}}
+            )
             
             processed_penalties.append(penalty["id"])
         else:
@@ -1069,7 +3898,7 @@ async def update_item(
     token_per_day: int = Form(...),
     availability_start: str = Form(...),
     availability_end: str = Form(...),
-    current_user: User = Depends(get_current_user)
+    current_user: TokenUser = Depends(get_token_user)
 ):
     # Check if item exists and user owns it
     item = await db.items.find_one({"id": item_id, "owner_id": current_user.id})
@@ -1090,18 +3919,26 @@ async def update_item(
         "value": value,
         "token_per_day": token_per_day,
         "availability_start": datetime.fromisoformat(availability_start),
-        "availability_end": datetime.fromisoformat(availability_end)
+        "availability_end": datetime.fromisoformat(availability_end),
+        "updated_at": datetime.now(timezone.utc)
     }
     
     await db.items.update_one({"id": item_id}, {"$set": update_data})
+    item_reads.invalidate(item_id)
     
     # Get updated item
     updated_item = await db.items.find_one({"id": item_id})
+    await adjust_catalog_facets(item, -1)
+    await adjust_catalog_facets(updated_item, 1)
+    await db.user_activities.update_many(
+        {"item.id": item_id},
+        {"$set": {"item": activity_item(updated_item)}}
+    )
     return Item(**updated_item)
 
 # Delete item
 @api_router.delete("/items/{item_id}")
-async def delete_item(item_id: str, current_user: User = Depends(get_current_user)):
+async def delete_item(item_id: str, current_user: TokenUser = Depends(get_token_user)):
     # Check if item exists and user owns it
     item = await db.items.find_one({"id": item_id, "owner_id": current_user.id})
     if not item:
@@ -1121,19 +3958,19 @@ async def delete_item(item_id: str, current_user: User = Depends(get_current_use
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     
-    # Delete images from Cloudinary
-    for url in item.get('images', []):
-        public_id = url.split('/')[-1].split('.')[0]  # Extract public_id
-        try:
-            cloudinary.uploader.destroy(public_id)
-        except Exception as e:
-            logger.error(f"Failed to delete image {url}: {e}")
+    await adjust_catalog_facets(item, -1)
+    await record_tombstones(current_user.id, "items", [item_id])
+    # Other replicas drop it when the delete event reaches them
+    autocomplete_index.remove("item", item_id)
+    
+    # Images are removed from Cloudinary by the background image GC worker
+    await enqueue_image_deletions(urls=item.get('images', []))
     
     return {"message": "Item deleted successfully"}
 
 # Toggle item availability
 @api_router.patch("/items/{item_id}/toggle-availability")
-async def toggle_item_availability(item_id: str, current_user: User = Depends(get_current_user)):
+async def toggle_item_availability(item_id: str, current_user: TokenUser = Depends(get_token_user)):
     # Check if item exists and user owns it
     item = await db.items.find_one({"id": item_id, "owner_id": current_user.id})
     if not item:
@@ -1141,7 +3978,13 @@ async def toggle_item_availability(item_id: str, current_user: User = Depends(ge
     
     # Toggle availability
     new_availability = not item["is_available"]
-    await db.items.update_one({"id": item_id}, {"$set": {"is_available": new_availability}})
+    now = datetime.now(timezone.utc)
+    await db.items.update_one({"id": item_id}, {"$set": {"is_available": new_availability, "updated_at": now}})
+    await db.user_activities.update_many(
+        {"item.id": item_id},
+        {"$set": {"item.is_available": new_availability, "item.updated_at": now}}
+    )
+    await adjust_catalog_facets({**item, "is_available": True}, 1 if new_availability else -1)
     
     return {"message": f"Item {'enabled' if new_availability else 'disabled'} successfully", "is_available": new_availability}
 
@@ -1173,13 +4016,35 @@ async def update_profile(
     # Update user
     await db.users.update_one({"id": current_user.id}, {"$set": update_data})
     
+    if username != current_user.username:
+        await db.user_activities.update_many(
+            {"counterpart.id": current_user.id},
+            {"$set": {"counterpart.username": username}}
+        )
+    
+    # Keep the owner location denormalized on items (and their facet counts) in sync
+    if location != current_user.location:
+        items = await db.items.find({"owner_id": current_user.id, "is_available": True}).to_list(None)
+        now = datetime.now(timezone.utc)
+        await db.items.update_many(
+            {"owner_id": current_user.id},
+            {"$set": {"owner_location": location, "updated_at": now}}
+        )
+        await db.user_activities.update_many(
+            {"item.id": {"$in": await db.items.distinct("id", {"owner_id": current_user.id})}},
+            {"$set": {"item.owner_location": location, "item.updated_at": now}}
+        )
+        for item in items:
+            await adjust_catalog_facets(item, -1)
+            await adjust_catalog_facets({**item, "owner_location": location}, 1)
+    
     # Get updated user
     updated_user = await db.users.find_one({"id": current_user.id})
     return UserProfile(**updated_user)
 
 # Delete user account
 @api_router.delete("/auth/account")
-async def delete_account(current_user: User = Depends(get_current_user)):
+async def delete_account(current_user: TokenUser = Depends(get_token_user)):
     # Check for active transactions
     active_transactions = await db.transactions.find({
         "$or": [{"borrower_id": current_user.id}, {"owner_id": current_user.id}],
@@ -1190,26 +4055,377 @@ async def delete_account(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=400, detail="Cannot delete account with active transactions. Please complete or cancel all active transactions first.")
     
     # Delete user's items (but keep transaction history for other users)
+    items = await db.items.find({"owner_id": current_user.id}).to_list(None)
     await db.items.delete_many({"owner_id": current_user.id})
+    await adjust_catalog_facets_many(items, -1)
+    await record_tombstones(current_user.id, "items", [item["id"] for item in items])
+    await enqueue_image_deletions(urls=[url for item in items for url in item.get("images", [])])
+    for item in items:
+        autocomplete_index.remove("item", item["id"])
     
     # Mark user as deleted (instead of actual deletion to preserve transaction history)
     await db.users.update_one(
         {"id": current_user.id}, 
         {"$set": {"is_banned": True, "username": f"deleted_user_{current_user.id[:8]}", "email": f"deleted_{current_user.id}@deleted.com"}}
     )
+    await db.user_activities.update_many(
+        {"counterpart.id": current_user.id},
+        {"$set": {"counterpart.username": f"deleted_user_{current_user.id[:8]}"}}
+    )
+    await revoke_user_tokens(current_user.id, "account_deleted")
     
     return {"message": "Account deleted successfully"}
 
+# Delta sync
+# Clients keep the opaque token from each /sync response and send it back to
+# receive only what changed since: documents whose updated_at moved past it,
+# plus tombstones for deletions.
+SYNC_MAX_CHANGES = 1000
+SYNC_TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))
+# Concurrent writes can commit slightly out of timestamp order; every token
+# points this far back so they are not missed (clients upsert by id)
+SYNC_OVERLAP_SECONDS = 5
+SYNC_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+SYNC_COLLECTIONS = ["items", "transactions", "notifications", "messages"]
+
+def to_millis(at: datetime) -> int:
+    return int(at.replace(tzinfo=at.tzinfo or timezone.utc).timestamp() * 1000)
+
+def from_millis(millis: int) -> datetime:
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+def encode_sync_token(since: datetime, cursors: Dict[str, Tuple[datetime, str]]) -> str:
+    """`cursors` holds the last (updated_at, id) returned for feeds that were
+    cut off at SYNC_MAX_CHANGES; other feeds resume after `since`"""
+    payload = {"v": 2, "since": to_millis(since), "cursors": {
+        collection: [to_millis(at), last_id] for collection, (at, last_id) in cursors.items()
+    }}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_sync_token(token: str) -> Tuple[datetime, Dict[str, Tuple[datetime, str]]]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        if raw.startswith("v1:"):
+            return from_millis(int(raw[3:])), {}
+        payload = json.loads(raw)
+        if payload["v"] != 2:
+            raise ValueError(payload["v"])
+        cursors = {
+            collection: (from_millis(int(at)), str(last_id))
+            for collection, (at, last_id) in payload["cursors"].items()
+            if collection in SYNC_COLLECTIONS
+        }
+        return from_millis(int(payload["since"])), cursors
+    except (ValueError, KeyError, TypeError, AttributeError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+async def record_tombstones(user_id: str, collection: str, ids: List[str]):
+    """Remember deletions so /sync can report them to the user's other devices"""
+    if not ids:
+        return
+    now = datetime.now(timezone.utc)
+    await db.sync_tombstones.insert_many([
+        {
+            "user_id": user_id,
+            "collection": collection,
+            "id": deleted_id,
+            "deleted_at": now,
+            "expires_at": now + timedelta(days=SYNC_TOMBSTONE_DAYS)
+        }
+        for deleted_id in ids
+    ])
+
+@api_router.get("/sync")
+async def sync_changes(since: Optional[str] = None, current_user: TokenUser = Depends(get_token_user)):
+    """Own items, transactions, notifications and messages changed since `since`.
+
+    Without a token (or with one older than the tombstone retention, flagged
+    by `reset`) everything is returned and the client should replace its
+    local state. `has_more` means the next token must be used right away.
+    """
+    started = datetime.now(timezone.utc)
+    since_at, cursors = decode_sync_token(since) if since else (SYNC_EPOCH, {})
+    reset = since is None or since_at < started - timedelta(days=SYNC_TOMBSTONE_DAYS)
+    if reset:
+        since_at, cursors = SYNC_EPOCH, {}
+    
+    def changed(collection: str) -> Dict[str, Any]:
+        # (updated_at, id) orders changes totally, so a page boundary inside
+        # a burst of writes sharing one timestamp still moves forward
+        if collection not in cursors:
+            return {"updated_at": {"$gt": since_at}}
+        at, last_id = cursors[collection]
+        return {"$or": [{"updated_at": {"$gt": at}}, {"updated_at": at, "id": {"$gt": last_id}}]}
+    
+    sources = {
+        "items": (db.items, {"owner_id": current_user.id, **changed("items")}),
+        "transactions": (db.transactions, {"$and": [
+            {"$or": [{"borrower_id": current_user.id}, {"owner_id": current_user.id}]},
+            changed("transactions")
+        ]}),
+        "notifications": (db.notifications, {"user_id": current_user.id, **changed("notifications")}),
+        "messages": (db.messages, {"$and": [
+            {"$or": [{"sender_id": current_user.id}, {"receiver_id": current_user.id}]},
+            changed("messages")
+        ]}),
+    }
+    results = await asyncio.gather(
+        *[
+            collection.find(query, {"_id": 0}).sort([("updated_at", 1), ("id", 1)]).limit(SYNC_MAX_CHANGES).to_list(None)
+            for collection, query in sources.values()
+        ],
+        db.sync_tombstones.find(
+            {"user_id": current_user.id, "deleted_at": {"$gt": since_at}}, {"_id": 0, "collection": 1, "id": 1}
+        ).to_list(None)
+    )
+    tombstones = results.pop()
+    
+    # Complete feeds resume from now (minus the overlap), truncated ones
+    # right after the last (updated_at, id) they returned
+    next_at = max(started - timedelta(seconds=SYNC_OVERLAP_SECONDS), since_at)
+    next_cursors = {
+        collection: (docs[-1]["updated_at"], docs[-1]["id"])
+        for collection, docs in zip(sources, results)
+        if len(docs) == SYNC_MAX_CHANGES
+    }
+    
+    deleted = {"items": [], "notifications": []}
+    for tombstone in tombstones:
+        deleted[tombstone["collection"]].append(tombstone["id"])
+    
+    return {
+        **dict(zip(sources, results)),
+        "deleted": deleted,
+        "reset": reset,
+        "has_more": bool(next_cursors),
+        "next_token": encode_sync_token(next_at, next_cursors)
+    }
+
 # Categories
 @api_router.get("/categories")
 async def get_categories():
     return {"categories": CATEGORIES}
 
+# Analytics rollups
+# Platform counters (borrow volume per category, token flow, penalties,
+# reviews, complaints) are aggregated into hourly and daily bucket documents
+# keyed by bucket start. Each run re-rolls the hours since the previous run
+# (plus one, for late writes) from the secondaries and replaces those buckets,
+# so reruns are idempotent. The admin API reads only the buckets. Valid
+# complaints count in the hour score_reputation validated them, since that
+# happens after their creation hour was rolled up.
+ANALYTICS_ROLLUP_SECONDS = float(os.getenv("ANALYTICS_ROLLUP_SECONDS", "300"))
+ANALYTICS_BACKFILL_DAYS = int(os.getenv("ANALYTICS_BACKFILL_DAYS", "365"))
+ANALYTICS_MAX_BUCKETS = 2000
+# Set ADMIN_TOKEN to enable the admin API (bearer token)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ROLLUP_COLLECTIONS = {"hour": "analytics_hourly", "day": "analytics_daily"}
+
+def floor_hour(at: datetime) -> datetime:
+    return at.replace(minute=0, second=0, microsecond=0)
+
+def add_rollup(total: Dict[str, Any], bucket: Dict[str, Any]):
+    """Sum the counters of `bucket` into `total`, including nested breakdowns"""
+    for key, value in bucket.items():
+        if isinstance(value, dict):
+            add_rollup(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+
+def empty_rollup() -> Dict[str, Any]:
+    return {
+        "borrow_requests": 0, "requested_tokens": 0, "borrow_requests_by_category": {},
+        "deliveries": 0, "tokens_transferred": 0, "completed": 0, "rejected": 0,
+        "penalties": 0, "penalty_tokens": 0, "reviews": 0, "review_stars": 0,
+        "complaints": 0, "valid_complaints": 0, "complaints_by_type": {},
+    }
+
+async def compute_hourly_rollups(start: datetime) -> Dict[datetime, Dict[str, Any]]:
+    def by_hour(field: str) -> Dict[str, Any]:
+        return {"$dateTrunc": {"date": f"${field}", "unit": "hour"}}
+
+    requests, deliveries, outcomes, penalties, reviews, complaints, valid_complaints = await asyncio.gather(
+        read_db.transactions.aggregate([
+            {"$match": {"created_at": {"$gte": start}}},
+            {"$lookup": {"from": "items", "localField": "item_id", "foreignField": "id", "as": "item"}},
+            {"$group": {
+                "_id": {"hour": by_hour("created_at"), "category": {"$ifNull": [{"$first": "$item.category"}, "Unknown"]}},
+                "count": {"$sum": 1},
+                "tokens": {"$sum": "$total_tokens"}
+            }}
+        ]).to_list(None),
+        read_db.transactions.aggregate([
+            {"$match": {"delivered_at": {"$gte": start}}},
+            {"$group": {
+                "_id": {"hour": by_hour("delivered_at")},
+                "count": {"$sum": 1},
+                "tokens": {"$sum": {"$ifNull": ["$tokens_paid", "$total_tokens"]}}
+            }}
+        ]).to_list(None),
+        read_db.transactions.aggregate([
+            {"$match": {
+                "status": {"$in": [TransactionStatus.COMPLETED, TransactionStatus.REJECTED]},
+                "updated_at": {"$gte": start}
+            }},
+            {"$group": {"_id": {"hour": by_hour("updated_at"), "status": "$status"}, "count": {"$sum": 1}}}
+        ]).to_list(None),
+        read_db.penalties.aggregate([
+            {"$match": {"created_at": {"$gte": start}}},
+            {"$group": {"_id": {"hour": by_hour("created_at")}, "count": {"$sum": 1}, "tokens": {"$sum": "$amount"}}}
+        ]).to_list(None),
+        read_db.reviews.aggregate([
+            {"$match": {"created_at": {"$gte": start}}},
+            {"$group": {"_id": {"hour": by_hour("created_at")}, "count": {"$sum": 1}, "stars": {"$sum": "$stars"}}}
+        ]).to_list(None),
+        read_db.complaints.aggregate([
+            {"$match": {"created_at": {"$gte": start}}},
+            {"$group": {"_id": {"hour": by_hour("created_at"), "type": "$type"}, "count": {"$sum": 1}}}
+        ]).to_list(None),
+        read_db.complaints.aggregate([
+            {"$match": {"scored_at": {"$gte": start}, "is_valid": True}},
+            {"$group": {"_id": {"hour": by_hour("scored_at")}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+    )
+    hours = defaultdict(empty_rollup)
+    def bucket(row):
+        return hours[row["_id"]["hour"].replace(tzinfo=timezone.utc)]
+    for row in requests:
+        add_rollup(bucket(row), {
+            "borrow_requests": row["count"],
+            "requested_tokens": row["tokens"],
+            "borrow_requests_by_category": {row["_id"]["category"]: row["count"]}
+        })
+    for row in deliveries:
+        add_rollup(bucket(row), {"deliveries": row["count"], "tokens_transferred": row["tokens"]})
+    for row in outcomes:
+        add_rollup(bucket(row), {row["_id"]["status"]: row["count"]})
+    for row in penalties:
+        add_rollup(bucket(row), {"penalties": row["count"], "penalty_tokens": row["tokens"]})
+    for row in reviews:
+        add_rollup(bucket(row), {"reviews": row["count"], "review_stars": row["stars"]})
+    for row in complaints:
+        add_rollup(bucket(row), {
+            "complaints": row["count"],
+            "complaints_by_type": {row["_id"]["type"]: row["count"]}
+        })
+    for row in valid_complaints:
+        add_rollup(bucket(row), {"valid_complaints": row["count"]})
+    return hours
+
+@periodic_job(ANALYTICS_ROLLUP_SECONDS)
+async def rollup_analytics():
+    now = datetime.now(timezone.utc)
+    state = await db.analytics_state.find_one({"_id": "rollups"})
+    if state:
+        start = floor_hour(state["rolled_at"].replace(tzinfo=timezone.utc)) - timedelta(hours=1)
+    else:
+        start = floor_hour(now - timedelta(days=ANALYTICS_BACKFILL_DAYS))
+    hours = await compute_hourly_rollups(start)
+    
+    # Every hour in range is replaced, so counts that went away are cleared too
+    operations, hour = [], start
+    while hour <= now:
+        operations.append(ReplaceOne({"_id": hour}, hours.get(hour) or empty_rollup(), upsert=True))
+        hour += timedelta(hours=1)
+    await db.analytics_hourly.bulk_write(operations, ordered=False)
+    
+    first_day = start.replace(hour=0)
+    days = defaultdict(empty_rollup)
+    async for bucket in db.analytics_hourly.find({"_id": {"$gte": first_day}}):
+        day = bucket.pop("_id").replace(hour=0, tzinfo=timezone.utc)
+        add_rollup(days[day], bucket)
+    await db.analytics_daily.bulk_write(
+        [ReplaceOne({"_id": day}, totals, upsert=True) for day, totals in days.items()],
+        ordered=False
+    )
+    await db.analytics_state.update_one({"_id": "rollups"}, {"$set": {"rolled_at": now}}, upsert=True)
+
+async def require_admin(request: Request):
+    if not ADMIN_TOKEN or request.headers.get("authorization") != f"Bearer {ADMIN_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@api_router.get("/admin/analytics", dependencies=[Depends(require_admin)])
+async def get_analytics(
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Rolled-up platform counters per hour or day in [start, end) with
+    totals; defaults to the last 30 days (48 hours for hourly buckets)"""
+    if granularity not in ROLLUP_COLLECTIONS:
+        raise HTTPException(status_code=400, detail="granularity must be 'hour' or 'day'")
+    end = end.replace(tzinfo=end.tzinfo or timezone.utc) if end else datetime.now(timezone.utc)
+    start = start.replace(tzinfo=start.tzinfo or timezone.utc) if start else end - (
+        timedelta(hours=48) if granularity == "hour" else timedelta(days=30)
+    )
+    span = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    if end <= start or (end - start) / span > ANALYTICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range must cover 1 to {ANALYTICS_MAX_BUCKETS} buckets")
+    
+    buckets, state = await asyncio.gather(
+        read_db[ROLLUP_COLLECTIONS[granularity]].find({"_id": {"$gte": start, "$lt": end}}).sort("_id", 1).to_list(None),
+        read_db.analytics_state.find_one({"_id": "rollups"})
+    )
+    totals = empty_rollup()
+    for bucket in buckets:
+        add_rollup(totals, bucket)
+    return {
+        "granularity": granularity,
+        "buckets": [{"start": bucket.pop("_id"), **bucket} for bucket in buckets],
+        "totals": {
+            **totals,
+            "average_stars": round(totals["review_stars"] / totals["reviews"], 2) if totals["reviews"] else None,
+            "complaint_rate": round(totals["complaints"] / totals["deliveries"], 4) if totals["deliveries"] else None,
+        },
+        "rolled_at": state["rolled_at"] if state else None
+    }
+
+# Composite screens
+# One round trip per screen: the handlers below fan out to the same queries
+# the individual endpoints run and return their results in a single payload.
+@api_router.get("/home", dependencies=[Depends(rate_limit("items"))])
+async def get_home(
+    category: Optional[str] = None,
+    location: Optional[str] = None,
+    search: Optional[str] = None,
+    current_user: TokenUser = Depends(get_token_user)
+):
+    """Categories, catalog summaries and notifications for the home screen"""
+    items, notifications = await asyncio.gather(
+        find_catalog_items(category, location, search, ITEM_SUMMARY_PROJECTION),
+        get_notifications(current_user=current_user)
+    )
+    return {
+        "categories": CATEGORIES,
+        "items": [msgspec.to_builtins(item_summary(item)) for item in items],
+        "notifications": notifications
+    }
+
+@api_router.get("/profile")
+async def get_profile(current_user: User = Depends(get_current_user)):
+    """The signed-in user with their reviews, complaints and penalties"""
+    reviews, complaints, penalties = await asyncio.gather(
+        get_user_reviews(current_user.id),
+        get_user_complaints(current_user.id),
+        get_my_penalties(current_user=current_user)
+    )
+    return {
+        "user": UserProfile(**current_user.dict()),
+        "reviews": reviews,
+        "complaints": complaints,
+        "penalties": penalties
+    }
+
 # Suggested token value
 @api_router.get("/suggested-tokens")
 async def get_suggested_tokens(value: int, category: str):
+    suggestion = token_price_model.suggest(value, category)
+    if suggestion:
+        return {**suggestion, "source": "market"}
+    # Not enough comparable items yet: use the static category multipliers
     suggested = calculate_token_value(value, category)
-    return {"suggested_tokens": suggested}
+    return {"suggested_tokens": suggested, "source": "default"}
 
 
 
@@ -1222,6 +4438,34 @@ async def health_check():
     """Health check endpoint for Render and UptimeRobot"""
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
+@app.api_route("/ready", methods=["GET", "HEAD"])
+async def readiness_check():
+    """Readiness probe: 200 only once MongoDB and indexes are ready and the
+    process is not draining, so load balancers only route to usable workers"""
+    if draining or not ready_event.is_set():
+        return JSONResponse(
+            {"status": "draining" if draining else "starting"},
+            status_code=503,
+            headers={"Retry-After": "5"}
+        )
+    return {"status": "ready", "timestamp": datetime.now(timezone.utc).isoformat()}
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    """In-process counters of this worker (each worker reports its own)"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return {
+        "pid": os.getpid(),
+        "in_flight_requests": in_flight_requests,
+        **{name: collect() for name, collect in metrics_sources.items()}
+    }
+
+# Innermost, so replays also pass through CORS and compression and keys are
+# only looked up once MongoDB is ready
+app.add_middleware(IdempotencyMiddleware)
+# Added before CORS so CORS headers are also applied to its 503 responses
+app.add_middleware(ReadinessMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1229,6 +4473,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -1239,10 +4484,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    global client
-    if client:
-        client.close()
-        print("MongoDB connection closed")
@@ -0,0 +1,110 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "tests")
+
+import server  # noqa: E402
+
+
+class FakeChangeStream:
+    """Async context manager yielding raw change documents like Motor's stream.
+
+    Raises `error` once the changes are exhausted, as a dropped connection would.
+    """
+
+    def __init__(self, changes, error):
+        self.changes = list(changes)
+        self.error = error
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.changes:
+            raise self.error
+        change = self.changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+
+class FakeChangeStreamDatabase:
+    """Stands in for `server.db`: each watch() serves the next batch of changes"""
+
+    def __init__(self, batches, error):
+        self.batches = list(batches)
+        self.error = error
+        self.watch_calls = []
+        self.commands = []
+
+    def watch(self, pipeline, **kwargs):
+        self.watch_calls.append(kwargs)
+        return FakeChangeStream(self.batches.pop(0) if self.batches else [], self.error)
+
+    async def command(self, name, value, **kwargs):
+        self.commands.append((name, value, kwargs))
+        return {"ok": 1}
+
+
+class FakeClient:
+    def __init__(self, version):
+        self.version = version
+
+    async def server_info(self):
+        return {"versionArray": self.version}
+
+
+def make_change(token, collection, operation, document, updated_fields=None, before=None):
+    change = {
+        "_id": {"_data": token},
+        "ns": {"db": "tests", "coll": collection},
+        "operationType": operation,
+        "fullDocument": document,
+    }
+    if updated_fields is not None:
+        change["updateDescription"] = {"updatedFields": updated_fields}
+    if before is not None:
+        change["fullDocumentBeforeChange"] = before
+    return change
+
+
+@pytest.fixture
+def change_stream(monkeypatch):
+    """Feed batches of raw changes to consume_change_stream without MongoDB.
+
+    Returns a function taking the batches (one per watch() call) and the
+    server version; it sets up the fake database and collects every
+    published event into the returned list.
+    """
+    published = []
+    real_sleep = server.asyncio.sleep
+
+    async def publish(event):
+        published.append(event)
+
+    async def no_backoff(delay):
+        await real_sleep(0)
+
+    def feed(batches, version=(7, 0, 0)):
+        database = FakeChangeStreamDatabase(batches, server.PyMongoError("connection lost"))
+        monkeypatch.setattr(server, "db", database)
+        monkeypatch.setattr(server, "client", FakeClient(list(version)))
+        monkeypatch.setattr(server.event_bus, "publish", publish)
+        monkeypatch.setattr(server.asyncio, "sleep", no_backoff)
+        monkeypatch.setattr(server, "CHANGE_STREAM_ENABLED", True)
+        server.ready_event.set()
+        return database, published
+
+    yield feed
+    server.ready_event.clear()
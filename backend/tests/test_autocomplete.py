@@ -0,0 +1,109 @@
+import asyncio
+import random
+
+import pytest
+
+import server
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # Small blocks so a few hundred keys exercise splits and emptied blocks
+    monkeypatch.setattr(server, "AUTOCOMPLETE_BLOCK_SIZE", 4)
+
+
+def brute_force(labels, query):
+    prefix = server.normalize_autocomplete(query)
+    return {
+        ref
+        for ref, text in labels.items()
+        if any(key.startswith(prefix) for key in server.autocomplete_keys(ref[0], text))
+    }
+
+
+def test_search_matches_brute_force_after_random_changes():
+    rng = random.Random(7)
+    words = ["bike", "drill", "tent", "ladder", "mountain", "camping", "power", "red"]
+
+    def title():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+
+    labels = {("item", str(i)): title() for i in range(100)}
+    index = server.PrefixIndex()
+    index.load([(kind, entity_id, text) for (kind, entity_id), text in labels.items()])
+    for _ in range(500):
+        ref = ("item", str(rng.randrange(150)))
+        if rng.random() < 0.3:
+            index.remove(*ref)
+            labels.pop(ref, None)
+        else:
+            labels[ref] = title()
+            index.add(*ref, labels[ref])
+
+    assert index.key_count == sum(len(server.autocomplete_keys("item", text)) for text in labels.values())
+    assert all(keys and keys[0] == first for keys, first in zip(index.key_blocks, index.firsts))
+    flat = [key for keys in index.key_blocks for key in keys]
+    assert flat == sorted(flat)
+    for query in words + ["b", "m", "power d", "zzz"]:
+        found = [(result["type"], result["id"]) for result in index.search(query, 1000)]
+        assert len(found) == len(set(found))
+        assert set(found) == brute_force(labels, query)
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def __aiter__(self):
+        for doc in self.docs:
+            yield doc
+
+
+class ChangingCollection:
+    """find() returns `docs`, then runs `changes` as if they arrived mid-read"""
+
+    def __init__(self, docs, changes=()):
+        self.docs = docs
+        self.changes = changes
+
+    def find(self, *args):
+        for change in self.changes:
+            change()
+        return Cursor(self.docs)
+
+
+class AutocompleteSource:
+    def __init__(self, items, users):
+        self.items = items
+        self.users = users
+
+
+def test_changes_during_rebuild_survive_the_swap(monkeypatch):
+    index = server.PrefixIndex()
+    index.load([("item", "1", "Old drill"), ("item", "2", "Tent")])
+    monkeypatch.setattr(server, "autocomplete_index", index)
+    items = ChangingCollection(
+        [{"id": "1", "title": "Old drill"}, {"id": "2", "title": "Tent"}],
+        [lambda: index.add("item", "3", "Camping stove"), lambda: index.remove("item", "2")]
+    )
+    monkeypatch.setattr(server, "read_db", AutocompleteSource(items, ChangingCollection([])))
+
+    asyncio.run(server.rebuild_autocomplete_index())
+    assert [result["id"] for result in index.search("camping", 10)] == ["3"]
+    assert index.search("tent", 10) == []
+    assert index.pending is None
+
+
+def test_delete_event_removes_the_item(monkeypatch):
+    index = server.PrefixIndex()
+    index.load([("item", "1", "Cordless drill"), ("item", "2", "Extension cord")])
+    monkeypatch.setattr(server, "autocomplete_index", index)
+    delete = {
+        "_id": {"_data": "1"},
+        "ns": {"db": "tests", "coll": "items"},
+        "operationType": "delete",
+        "fullDocumentBeforeChange": {"id": "2", "title": "Extension cord"},
+    }
+    for event in server.normalize_change(delete):
+        asyncio.run(server.autocomplete_on_item_changed(event))
+    assert [result["id"] for result in index.search("cord", 10)] == ["1"]
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import server
+from conftest import make_change
+
+
+async def consume_until(published, count):
+    task = asyncio.create_task(server.consume_change_stream())
+    try:
+        for _ in range(1000):
+            if len(published) >= count:
+                break
+            await asyncio.sleep(0)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_normalize_change_maps_balance_updates():
+    change = make_change("1", "users", "update", {"id": "u1", "tokens": 5}, {"tokens": 5, "stats.lent": 1})
+    events = server.normalize_change(change)
+    assert [event["type"] for event in events] == ["user.changed", "user.balance_changed"]
+    assert events[0]["id"] == "u1"
+    assert events[0]["fields"] == ["tokens", "stats"]
+
+
+def test_normalize_change_takes_delete_ids_from_the_pre_image():
+    change = make_change("1", "items", "delete", None, before={"id": "i1", "title": "Drill"})
+    [event] = server.normalize_change(change)
+    assert event["type"] == "item.changed"
+    assert event["id"] == "i1"
+    assert event["document"] is None
+
+
+def test_normalize_change_ignores_unrelated_transaction_updates():
+    change = make_change("1", "transactions", "update", {"id": "t1"}, {"updated_at": 1})
+    assert server.normalize_change(change) == []
+
+
+def test_consumer_publishes_events_and_starts_from_now(change_stream):
+    database, published = change_stream([[
+        make_change("1", "items", "insert", {"id": "i1"}),
+        make_change("2", "transactions", "insert", {"id": "t1"}),
+    ]])
+    asyncio.run(consume_until(published, 2))
+    assert [event["type"] for event in published] == ["item.changed", "transaction.status_changed"]
+    # Subscribers rebuild their state at startup, so nothing is replayed
+    assert database.watch_calls[0]["resume_after"] is None
+
+
+def test_consumer_resumes_from_last_token_after_disconnect(change_stream):
+    database, published = change_stream([
+        [make_change("1", "items", "insert", {"id": "i1"})],
+        [make_change("2", "items", "delete", None, before={"id": "i1"})],
+    ])
+    asyncio.run(consume_until(published, 2))
+    assert [(event["operation"], event["id"]) for event in published] == [("insert", "i1"), ("delete", "i1")]
+    assert database.watch_calls[1]["resume_after"] == {"_data": "1"}
+
+
+@pytest.mark.parametrize("version, before_change", [((5, 0, 9), None), ((6, 0, 0), "whenAvailable")])
+def test_consumer_requests_pre_images_only_from_mongodb_6(change_stream, version, before_change):
+    database, published = change_stream([[make_change("1", "items", "insert", {"id": "i1"})]], version=version)
+    asyncio.run(consume_until(published, 1))
+    assert database.watch_calls[0]["full_document_before_change"] == before_change
+
+
+@pytest.mark.parametrize("version, enabled", [((5, 0, 9), []), ((6, 0, 0), server.CHANGE_STREAM_PRE_IMAGE_COLLECTIONS)])
+def test_pre_images_are_enabled_on_mongodb_6(change_stream, version, enabled):
+    database, _ = change_stream([], version=version)
+    asyncio.run(server.enable_change_stream_pre_images())
+    assert database.commands == [
+        ("collMod", collection, {"changeStreamPreAndPostImages": {"enabled": True}}) for collection in enabled
+    ]
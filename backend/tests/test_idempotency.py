@@ -0,0 +1,19 @@
+import server
+
+
+def scope(path, query_string=b""):
+    return {"type": "http", "method": "POST", "path": path, "query_string": query_string}
+
+
+def test_fingerprint_covers_query_string():
+    path = "/api/transactions/t1/confirm-return"
+    none = server.request_fingerprint(scope(path, b"damage_severity=none"), b"")
+    high = server.request_fingerprint(scope(path, b"damage_severity=high"), b"")
+    assert none != high
+    assert none == server.request_fingerprint(scope(path, b"damage_severity=none"), b"")
+
+
+def test_fingerprint_covers_path_and_body():
+    base = server.request_fingerprint(scope("/api/items"), b'{"a": 1}')
+    assert base != server.request_fingerprint(scope("/api/items"), b'{"a": 2}')
+    assert base != server.request_fingerprint(scope("/api/messages"), b'{"a": 1}')
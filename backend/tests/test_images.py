@@ -0,0 +1,35 @@
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+import server
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def with_declared_size(data, width, height):
+    """The PNG with its IHDR claiming another size (pixel data unchanged)"""
+    ihdr = data[12:16] + struct.pack(">II", width, height) + data[24:29]
+    return data[:12] + ihdr + struct.pack(">I", zlib.crc32(ihdr)) + data[33:]
+
+
+def test_render_image_encodes_every_rendition():
+    renditions = server.render_image(png(2000, 1000))
+    assert set(renditions) == set(server.IMAGE_RENDITIONS)
+    for name, size in server.IMAGE_RENDITIONS.items():
+        with Image.open(io.BytesIO(renditions[name])) as image:
+            assert image.format == "WEBP"
+            assert max(image.size) == size
+
+
+@pytest.mark.parametrize("data", [b"not an image", with_declared_size(png(1, 1), 30000, 30000)])
+def test_render_image_rejects_undecodable_and_oversized_images(data):
+    with pytest.raises(ValueError):
+        server.render_image(data)
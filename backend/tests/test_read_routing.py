@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+import server
+
+
+class RecordingCollection:
+    def __init__(self, database, name, documents):
+        self.database = database
+        self.name = name
+        self.documents = documents
+
+    async def find_one(self, query, *args, **kwargs):
+        self.database.reads.append(self.name)
+        return next(
+            (doc for doc in self.documents if all(doc.get(k) == v for k, v in query.items())),
+            None
+        )
+
+
+class RecordingDatabase:
+    """Stands in for one database handle and records which collections it read"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.reads = []
+
+    def __getattr__(self, name):
+        return RecordingCollection(self, name, self.documents.get(name, []))
+
+
+@pytest.fixture
+def replica_set(monkeypatch):
+    """A three-member replica set client (never connected) and recording
+    primary/secondary handles installed as server.db and server.read_db"""
+    mongo_client = AsyncIOMotorClient(
+        "mongodb://rs0.local,rs1.local,rs2.local/?replicaSet=rs0", connect=False, **server.mongo_client_options()
+    )
+    now = datetime.now(timezone.utc)
+    item = {
+        "id": "i1", "title": "Drill", "description": "Cordless", "category": "Tools", "value": 100,
+        "token_per_day": 5, "owner_id": "u1", "availability_start": now, "availability_end": now,
+    }
+    primary = RecordingDatabase({"items": [item]})
+    secondary = RecordingDatabase({"items": [{**item, "title": "Stale drill"}]})
+    monkeypatch.setattr(server, "db", primary)
+    monkeypatch.setattr(server, "read_db", secondary)
+    yield mongo_client, primary, secondary
+    mongo_client.close()
+
+
+def test_database_handles_route_tolerant_reads_to_secondaries(replica_set, monkeypatch):
+    mongo_client, _, _ = replica_set
+    db, read_db = server.database_handles(mongo_client)
+    assert isinstance(db.read_preference, Primary)
+    assert isinstance(read_db.read_preference, SecondaryPreferred)
+    assert read_db.read_preference.max_staleness == -1
+
+    monkeypatch.setattr(server, "MONGO_MAX_STALENESS_SECONDS", 120)
+    _, read_db = server.database_handles(mongo_client)
+    assert read_db.read_preference.max_staleness == 120
+
+
+def test_get_item_reads_from_primary(replica_set):
+    _, primary, secondary = replica_set
+    server.item_reads.invalidate("i1")
+    item = asyncio.run(server.get_item("i1"))
+    assert item.title == "Drill"
+    assert primary.reads == ["items"]
+    assert secondary.reads == []
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+import profile_startup
+
+# Seconds from launching uvicorn until GET /health answers
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "3"))
+
+
+def test_time_to_first_healthy_response_within_budget():
+    elapsed = profile_startup.time_to_healthy(timeout=max(STARTUP_BUDGET_SECONDS * 5, 30))
+    assert elapsed is not None, "/health never answered"
+    assert elapsed <= STARTUP_BUDGET_SECONDS
+
+
+def test_heavy_dependencies_are_not_imported_at_startup():
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, server; print(' '.join(sorted(sys.modules)))"],
+        cwd=profile_startup.BACKEND_DIR, env=profile_startup.server_env(),
+        capture_output=True, text=True, check=True
+    )
+    loaded = set(result.stdout.split())
+    assert not loaded & {"PIL", "scipy", "cloudinary", "passlib"}
@@ -20,6 +20,35 @@ const API = `${BACKEND_URL}/api`;
 // Configure axios defaults
 axios.defaults.headers.common['Content-Type'] = 'application/json';
 
+// Access tokens are short-lived: on a 401, swap the refresh token for a new
+// pair once and retry the original request
+let refreshRequest = null;
+axios.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (error.response?.status !== 401 || !refreshToken || original._retried || original.url?.endsWith('/auth/refresh')) {
+      return Promise.reject(error);
+    }
+    original._retried = true;
+    try {
+      refreshRequest = refreshRequest || axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken });
+      const { data } = await refreshRequest;
+      localStorage.setItem('token', data.access_token);
+      localStorage.setItem('refresh_token', data.refresh_token);
+      axios.defaults.headers.common['Authorization'] = `Bearer ${data.access_token}`;
+      original.headers['Authorization'] = `Bearer ${data.access_token}`;
+      return axios(original);
+    } catch (refreshError) {
+      localStorage.removeItem('refresh_token');
+      return Promise.reject(error);
+    } finally {
+      refreshRequest = null;
+    }
+  }
+);
+
 // Auth Provider Component
 const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
@@ -47,6 +76,7 @@ const AuthProvider = ({ children }) => {
       setToken(null);
       setUser(null);
       localStorage.removeItem('token');
+      localStorage.removeItem('refresh_token');
       delete axios.defaults.headers.common['Authorization'];
     } finally {
       setLoading(false);
@@ -60,11 +90,12 @@ const AuthProvider = ({ children }) => {
   const login = async (credentials) => {
     try {
       const response = await axios.post(`${API}/auth/login`, credentials);
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       setToken(access_token);
       setUser(userData);
       localStorage.setItem('token', access_token);
+      localStorage.setItem('refresh_token', refresh_token);
       axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
       
       return { success: true };
@@ -76,11 +107,12 @@ const AuthProvider = ({ children }) => {
   const register = async (userData) => {
     try {
       const response = await axios.post(`${API}/auth/register`, userData);
-      const { access_token, user: newUser } = response.data;
+      const { access_token, refresh_token, user: newUser } = response.data;
       
       setToken(access_token);
       setUser(newUser);
       localStorage.setItem('token', access_token);
+      localStorage.setItem('refresh_token', refresh_token);
       axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
       
       return { success: true };
@@ -93,6 +125,7 @@ const AuthProvider = ({ children }) => {
     setToken(null);
     setUser(null);
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     delete axios.defaults.headers.common['Authorization'];
     setLoading(false);
   };
@@ -632,6 +665,7 @@ const BrowseItemsScreen = () => {
       if (filters.category) params.append('category', filters.category);
       if (filters.location) params.append('location', filters.location);
       if (filters.search) params.append('search', filters.search);
+      params.append('view', 'summary');
       
       const response = await axios.get(`${API}/items?${params}`);
       setItems(response.data);
@@ -705,9 +739,9 @@ const BrowseItemsScreen = () => {
           {items.map((item) => (
             <div key={item.id} className="bg-white rounded-lg shadow-md overflow-hidden hover:shadow-lg transition-shadow">
               <div className="h-48 bg-gray-200 overflow-hidden">
-                {item.images && item.images.length > 0 ? (
+                {item.image ? (
                   <img
-                    src={item.images[0]}
+                    src={item.image}
                     alt={item.title}
                     className="w-full h-full object-cover"
                   />
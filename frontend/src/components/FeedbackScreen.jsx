@@ -45,14 +45,14 @@ const FeedbackScreen = () => {
 
   const fetchTransactionDetails = async () => {
     try {
-      // Get transaction from activities
-      const activitiesResponse = await axios.get(`${API}/my-activities`);
-      const allTransactions = [
-        ...activitiesResponse.data.as_borrower,
-        ...activitiesResponse.data.as_owner
-      ];
-      
-      const transactionData = allTransactions.find(t => t.transaction.id === transactionId);
+      // Get this transaction from activities
+      let transactionData;
+      try {
+        const activityResponse = await axios.get(`${API}/my-activities/${transactionId}`);
+        transactionData = activityResponse.data;
+      } catch (error) {
+        if (error.response?.status !== 404) throw error;
+      }
       
       if (!transactionData) {
         setError('Transaction not found');